@@ -1,14 +1,169 @@
 import re
+import json
+import asyncio
+import bisect
+import contextvars
+import functools
+import hashlib
+import importlib.util
+import io
 import logging
-import base64
+import mmap
+import os
+import sqlite3
+import threading
 from pathlib import Path
+from typing import (Awaitable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple,
+                    TypeVar, Union)
 
+import httpx
 from gen_ai_hub.proxy.langchain.openai import ChatOpenAI
-from gen_ai_hub.proxy.core.proxy_clients import get_proxy_client
+from gen_ai_hub.proxy.native.openai import AsyncOpenAI
 from langchain_core.messages import HumanMessage
 
+from hub_config import HubConfig, get_hub_proxy_client
+
+try:
+    # SIMD-accelerated drop-in replacement for the stdlib encoder
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+T = TypeVar('T')
+
+# The LLM of the pooled run the current task belongs to. asyncio tasks copy the
+# context they are created in, so every request of a run sees its own client
+_run_llm: contextvars.ContextVar[Optional[ChatOpenAI]] = contextvars.ContextVar(
+    'run_llm', default=None
+)
+
+DEFAULT_CACHE_PATH = Path(__file__).parent.parent / 'assets' / 'cache' / 'img_desc.db'
+
+# Words of the context window. Image tags and HTML tags (which include the picture
+# placeholder comment) are tokens of their own, so text glued to a tag, as in
+# `</figure>Next`, is a separate word on the right side of the tag boundary
+_WORD_RE = re.compile(r'!\[.*?\]\(.*?\)|<[/!A-Za-z][^<>]*>'
+                      r'|(?:[^\s<!]|!(?!\[)|<(?![/!A-Za-z]))+|[<!]')
+# Image tags (with the whitespace around them) and whitespace runs both collapse
+# to a single space, so the context is cleaned in one regex pass
+_CONTEXT_CLEANUP_RE = re.compile(r'(?:\s*!\[.*?\]\(.*?\))+\s*|\s+')
+
+IMAGE_PROMPT_TEMPLATE = (
+    'Describe the following image concisely. '
+    'Use the accompanying text context from the PDF page '
+    'where the image appeared to inform the description. '
+    'Focus on what the image visually shows '
+    'and how it relates to the text, if possible. '
+    'Avoid stating "The image shows...".\n\n'
+    'Text Context:\n---\n'
+    '{context}\n---\n\nImage:\n'
+)
+
+BATCH_PROMPT_TEMPLATE = (
+    'Describe each of the following {count} images concisely. '
+    'Every image is preceded by its id and the accompanying text context '
+    'from the PDF page where it appeared; use that context to inform '
+    'the description. Focus on what the image visually shows '
+    'and how it relates to the text, if possible. '
+    'Avoid stating "The image shows...".\n'
+    'Return strict JSON only, without markdown fences, in the form: '
+    '[{{"id": 0, "desc": "..."}}, ...]\n'
+)
+
+# With 'low' detail the model only sees a 512px rendition, so larger images are
+# downscaled before upload
+MAX_IMAGE_SIDE = 1024
+JPEG_QUALITY = 75
+
+# Cached descriptions are invalidated whenever the prompts change
+PROMPT_VERSION = hashlib.blake2b(
+    (IMAGE_PROMPT_TEMPLATE + BATCH_PROMPT_TEMPLATE).encode('utf-8'), digest_size=8
+).hexdigest()
+
+
+def _downscale_to_jpeg(image_source) -> Optional[bytes]:
+    '''
+    Returns the image (a path or a binary file object) re-encoded as a JPEG no larger
+    than MAX_IMAGE_SIDE, or None if it is already small enough or can't be decoded
+    '''
+    try:
+        with Image.open(image_source) as image:
+            if max(image.size) <= MAX_IMAGE_SIDE:
+                return None
+
+            image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+            return buffer.getvalue()
+    except OSError as os_err:
+        logging.warning('    - Could not downscale %s, sending it unchanged: %s',
+                        getattr(image_source, 'name', image_source), os_err)
+        return None
+
+
+@functools.lru_cache(maxsize=256)
+def _downscaled_jpeg(image_path: str, mtime_ns: int) -> Optional[bytes]:  # pylint: disable=unused-argument
+    '''
+    Cached _downscale_to_jpeg for image files. The mtime is part of the cache key only
+    '''
+    return _downscale_to_jpeg(image_path)
+
+
+class InMemoryImage(NamedTuple):
+    '''
+    A PNG-encoded picture that was never written to disk, e.g. taken straight from
+    a Docling document. `name` is only used in log messages
+    '''
+    name: str
+    data: bytes
+
+
+ImageSource = Union[Path, InMemoryImage]
+
+
+class DescriptionCache:
+    '''
+    Persistent exact-match cache of image descriptions backed by SQLite,
+    keyed by image content hash and prompt version
+    '''
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS descriptions (key TEXT PRIMARY KEY, description TEXT)'
+        )
+        self._conn.commit()
+        logging.info('Image description cache opened at %s', db_path)
+
+    def get(self, key: str) -> Optional[str]:
+        '''Returns the cached description or None on a miss.'''
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT description FROM descriptions WHERE key = ?', (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, description: str):
+        '''Stores a description under the given key.'''
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO descriptions (key, description) VALUES (?, ?)',
+                (key, description)
+            )
+            self._conn.commit()
+
 
 class MarkdownImageProcessor:
     '''
@@ -17,66 +172,153 @@ class MarkdownImageProcessor:
     the image and surrounding text
     '''
 
-    def __init__(self, hub_config: dict, context_words: int = 150):
+    def __init__(self, hub_config: Union[HubConfig, dict], context_words: int = 150,
+                 max_concurrency: int = 16, batch_size: int = 4,
+                 cache_path: Optional[Path] = DEFAULT_CACHE_PATH, proxy_client=None):
         """
-        Initialize with a config dict containing keys:
-        'hub_base_url', 'hub_auth_url', 'hub_client_id', 'hub_client_secret'.
+        Initialize with a HubConfig (or a dict with the same keys:
+        'hub_base_url', 'hub_auth_url', 'hub_client_id', 'hub_client_secret').
+        `proxy_client` reuses an already authenticated client; by default the client
+        shared by all processors with the same config is used.
+        `max_concurrency` bounds the number of in-flight description requests,
+        `batch_size` is the number of images packed into a single request.
+        Descriptions are cached in `cache_path`; pass None to disable the cache.
         """
-        proxy_client_instance = get_proxy_client(
-            proxy_version='gen-ai-hub',
-            base_url=hub_config['hub_base_url'],
-            auth_url=hub_config['hub_auth_url'],
-            client_id=hub_config['hub_client_id'],
-            client_secret=hub_config['hub_client_secret']
-        )
+        if isinstance(hub_config, dict):
+            hub_config = HubConfig(**hub_config)
+        proxy_client_instance = proxy_client or get_hub_proxy_client(hub_config)
 
-        self.llm = ChatOpenAI(
-            proxy_client=proxy_client_instance,
-            proxy_model_name='gpt-4o',
-            temperature=0.1,
-            max_tokens=200
-        )
+        self.proxy_client = proxy_client_instance
+        self.llm = self._new_llm()
 
         self.context_words = context_words
+        self.max_concurrency = max_concurrency
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._sem_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.batch_size = max(1, batch_size)
+        self.cache = DescriptionCache(cache_path) if cache_path else None
         self.image_tag_pattern = re.compile(r'!\[(.*?)\]\((.*?)\)')
         logging.info('MarkdownImageProcessor initialized. Context window: %d words',
                       self.context_words)
 
-    def _describe_image(self, image_path: Path, context_text: str) -> str:
+    def _new_llm(self) -> ChatOpenAI:
         '''
-        Describes an image using the configured multimodal model
+        Returns a chat model for the description requests
         '''
 
-        if not image_path.exists():
-            logging.error('    - Image file not found: %s', image_path)
-            raise FileNotFoundError('Can\'t find the image file')
+        return ChatOpenAI(
+            proxy_client=self.proxy_client,
+            proxy_model_name='gpt-4o',
+            temperature=0.1,
+            max_tokens=200
+        )
 
-        try:
+    def _llm(self) -> ChatOpenAI:
+        '''
+        Returns the chat model of the current pooled run, or the shared one outside a run
+        '''
+
+        return _run_llm.get() or self.llm
+
+    async def _run_pooled(self, coro: Awaitable[T]) -> T:
+        '''
+        Runs coro with the requests sent through a chat model of its own, whose async
+        OpenAI client keeps a keep-alive connection pool, so only the first request pays
+        the TCP/TLS handshake. HTTP/2 is used when h2 is installed. The model and pool
+        belong to this run and are closed with it; the shared self.llm is not touched,
+        so concurrent runs on one processor don't interfere
+        '''
+
+        async with httpx.AsyncClient(
+            http2=importlib.util.find_spec('h2') is not None,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            timeout=60
+        ) as http_client:
+            llm = self._new_llm()
+            llm.async_client = AsyncOpenAI(
+                proxy_client=self.proxy_client, http_client=http_client
+            ).chat.completions
+            token = _run_llm.set(llm)
+            try:
+                return await coro
+            finally:
+                _run_llm.reset(token)
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        '''
+        Returns the request semaphore of the running event loop
+        '''
+
+        loop = asyncio.get_running_loop()
+        if self._sem_loop is not loop:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+            self._sem_loop = loop
+        return self._sem
+
+    @staticmethod
+    def _cache_key(image_path: ImageSource) -> str:
+        '''
+        Builds the cache key from the image content hash and the prompt version
+        '''
+
+        if isinstance(image_path, InMemoryImage):
+            digest = hashlib.blake2b(image_path.data, digest_size=16)
+        else:
             with open(image_path, 'rb') as image_file:
-                image_bytes = image_file.read()
-
-            mime_type = f'image/{image_path.suffix.lower().strip(".")}'
-            if mime_type == 'image/jpg':
-                mime_type = 'image/jpeg'
-            if mime_type not in ['image/png', 'image/jpeg', 'image/gif', 'image/webp']:
-                logging.warning('    - Potentially unsupported image type for API: %s. ' \
-                'Using image/png', mime_type)
-                mime_type = 'image/png'
-
-            base64_image = base64.b64encode(image_bytes).decode('utf-8')
-            image_url = f'data:{mime_type};base64,{base64_image}'
-
-            prompt = (
-                'Describe the following image concisely. '
-                'Use the accompanying text context from the PDF page '
-                'where the image appeared to inform the description. '
-                'Focus on what the image visually shows '
-                'and how it relates to the text, if possible. '
-                'Avoid stating "The image shows...".\n\n'
-                'Text Context:\n---\n'
-                f'{context_text[:2000]}\n---\n\nImage:\n'
-            )
+                digest = hashlib.file_digest(image_file, lambda: hashlib.blake2b(digest_size=16))
+        return f'{digest.hexdigest()}:{PROMPT_VERSION}'
 
+    def _image_to_data_url(self, image_path: ImageSource) -> str:
+        '''
+        Reads an image and encodes it as a base64 data URL.
+        Images larger than MAX_IMAGE_SIDE are downscaled to JPEG first
+        '''
+
+        if isinstance(image_path, InMemoryImage):
+            jpeg_bytes = _downscale_to_jpeg(io.BytesIO(image_path.data)) if Image else None
+            if jpeg_bytes is not None:
+                return (b'data:image/jpeg;base64,' + base64.b64encode(jpeg_bytes)).decode('ascii')
+            return (b'data:image/png;base64,' + base64.b64encode(image_path.data)).decode('ascii')
+
+        if Image is not None:
+            jpeg_bytes = _downscaled_jpeg(str(image_path), image_path.stat().st_mtime_ns)
+            if jpeg_bytes is not None:
+                return (b'data:image/jpeg;base64,' + base64.b64encode(jpeg_bytes)).decode('ascii')
+
+        mime_type = f'image/{image_path.suffix.lower().strip(".")}'
+        if mime_type == 'image/jpg':
+            mime_type = 'image/jpeg'
+        if mime_type not in ['image/png', 'image/jpeg', 'image/gif', 'image/webp']:
+            logging.warning('    - Potentially unsupported image type for API: %s. ' \
+            'Using image/png', mime_type)
+            mime_type = 'image/png'
+
+        # Encode straight from a read-only mapping of the file to avoid an
+        # intermediate bytes copy, and only decode the ASCII URL at the boundary
+        data_url = bytearray(b'data:' + mime_type.encode('ascii') + b';base64,')
+        with open(image_path, 'rb') as image_file:
+            if image_path.stat().st_size > 0:
+                with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as image_map:
+                    data_url += base64.b64encode(image_map)
+
+        return data_url.decode('ascii')
+
+    async def _adescribe_image(self, image_path: ImageSource, context_text: str,
+                               cache_key: Optional[str] = None) -> str:
+        '''
+        Describes an image using the configured multimodal model
+        '''
+
+        try:
+            if self.cache and cache_key is None:
+                cache_key = await asyncio.to_thread(self._cache_key, image_path)
+                cached_description = self.cache.get(cache_key)
+                if cached_description is not None:
+                    logging.info('    - Using cached description for %s', image_path.name)
+                    return cached_description
+
+            image_url = await asyncio.to_thread(self._image_to_data_url, image_path)
+            prompt = IMAGE_PROMPT_TEMPLATE.format(context=context_text[:2000])
 
             messages = [
                 HumanMessage(
@@ -93,10 +335,13 @@ class MarkdownImageProcessor:
                 )
             ]
 
-            response = self.llm.invoke(messages)
+            async with self._semaphore():
+                response = await self._llm().ainvoke(messages)
             description = response.content.strip()
 
             clean_description = description.replace('\n', ' ').strip()
+            if self.cache and cache_key:
+                self.cache.set(cache_key, clean_description)
             return clean_description
 
         except FileNotFoundError:
@@ -110,59 +355,268 @@ class MarkdownImageProcessor:
                            image_path.name, e, exc_info=True)
             return f'Error describing image {image_path.name}'
 
-    def _extract_and_clean_context(self, full_text: str,
+    async def _adescribe_images_batch(self, items: List[Tuple[ImageSource, str]]) -> List[str]:
+        '''
+        Describes several images with a single request to the multimodal model.
+        Falls back to one request per image if the response can't be parsed
+        '''
+
+        if len(items) == 1:
+            return [await self._adescribe_image(*items[0])]
+
+        descriptions: List[Optional[str]] = [None] * len(items)
+        cache_keys: List[Optional[str]] = [None] * len(items)
+        if self.cache:
+            for idx, (image_path, _) in enumerate(items):
+                cache_keys[idx] = await asyncio.to_thread(self._cache_key, image_path)
+                descriptions[idx] = self.cache.get(cache_keys[idx])
+
+        pending = [idx for idx, description in enumerate(descriptions) if description is None]
+        if len(pending) < len(items):
+            logging.info('    - Using %d cached descriptions', len(items) - len(pending))
+        if not pending:
+            return descriptions
+        if len(pending) == 1:
+            idx = pending[0]
+            descriptions[idx] = await self._adescribe_image(*items[idx], cache_key=cache_keys[idx])
+            return descriptions
+
+        try:
+            prompt = BATCH_PROMPT_TEMPLATE.format(count=len(pending))
+
+            content = [{'type': 'text', 'text': prompt}]
+            for request_id, idx in enumerate(pending):
+                image_path, context_text = items[idx]
+                content.append({
+                    'type': 'text',
+                    'text': f'Image id: {request_id}\nText Context:\n---\n{context_text[:2000]}\n---'
+                })
+                image_url = await asyncio.to_thread(self._image_to_data_url, image_path)
+                content.append({
+                    'type': 'image_url',
+                    'image_url': {
+                        'url': image_url,
+                        'detail': 'low'
+                    }
+                })
+
+            async with self._semaphore():
+                response = await self._llm().ainvoke([HumanMessage(content=content)],
+                                                      max_tokens=200 * len(pending))
+            parsed = json.loads(response.content.strip())
+            batch_descriptions = {int(entry['id']): str(entry['desc']) for entry in parsed}
+
+            if set(batch_descriptions) != set(range(len(pending))):
+                raise ValueError('Response ids do not match the requested images')
+
+            for request_id, idx in enumerate(pending):
+                descriptions[idx] = batch_descriptions[request_id].replace('\n', ' ').strip()
+                if self.cache:
+                    self.cache.set(cache_keys[idx], descriptions[idx])
+            return descriptions
+
+        except (ValueError, KeyError, TypeError) as parse_err:
+            logging.warning('    - Could not parse batched description (%s). '
+                            'Falling back to single requests', parse_err)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error('    - Batched description request failed: %s. '
+                          'Falling back to single requests', e, exc_info=True)
+
+        fallback_descriptions = await asyncio.gather(*[
+            self._adescribe_image(*items[idx], cache_key=cache_keys[idx]) for idx in pending
+        ])
+        for idx, description in zip(pending, fallback_descriptions):
+            descriptions[idx] = description
+        return descriptions
+
+    @staticmethod
+    def _split_words(text: str) -> Tuple[List[str], List[int]]:
+        '''
+        Splits the text into words and their start offsets, breaking at tag boundaries
+        '''
+
+        words = []
+        word_starts = []
+        for word_match in _WORD_RE.finditer(text):
+            words.append(word_match.group())
+            word_starts.append(word_match.start())
+        return words, word_starts
+
+    def _extract_and_clean_context(self, words: List[str], word_starts: List[int],
                                    match_start: int, match_end: int) -> str:
         '''
         Extracts text around the match and removes other image tags.
-        Uses word count for context window
+        Uses word count for context window over the words of the file,
+        which are split once per file together with their start offsets
         '''
 
-        text_before_match = full_text[:match_start]
-        text_after_match = full_text[match_end:]
-
-        words_before = text_before_match.split()
-        words_after = text_after_match.split()
+        before_end = bisect.bisect_left(word_starts, match_start)
+        after_start = bisect.bisect_left(word_starts, match_end)
 
-        context_before = ' '.join(words_before[-self.context_words:])
-        context_after = ' '.join(words_after[:self.context_words])
-        context = self.image_tag_pattern.sub('', context_before + ' ' + context_after)
-        context = re.sub(r'\s+', ' ', context).strip()
+        context_before = ' '.join(words[max(0, before_end - self.context_words):before_end])
+        context_after = ' '.join(words[after_start:after_start + self.context_words])
+        context = _CONTEXT_CLEANUP_RE.sub(' ', context_before + ' ' + context_after).strip()
 
         return context
 
-    def process_markdown_file(self, md_file_path: Path):
+    @staticmethod
+    def _list_files(directory: Path) -> Set[str]:
+        '''
+        Returns the names of the files in a directory, or an empty set if it doesn't exist
+        '''
+
+        try:
+            with os.scandir(directory) as entries:
+                return {entry.name for entry in entries if entry.is_file()}
+        except FileNotFoundError:
+            return set()
+
+    @staticmethod
+    def _splice_descriptions(content: str, spans: Iterable[Tuple[int, int]],
+                             descriptions: Iterable[str]) -> str:
+        '''
+        Replaces each (start, end) span of the content with its description.
+        Spans must be sorted and non-overlapping; the result is built in one pass
+        '''
+
+        parts = []
+        cursor = 0
+        for (span_start, span_end), description in zip(spans, descriptions):
+            parts.append(content[cursor:span_start])
+            parts.append(description)
+            cursor = span_end
+        parts.append(content[cursor:])
+
+        return ''.join(parts)
+
+    @staticmethod
+    def _done_marker_path(md_file_path: Path) -> Path:
+        '''
+        Returns the sidecar path marking a markdown file as fully described
+        '''
+
+        return md_file_path.with_name(md_file_path.name + '.done')
+
+    def _mark_done(self, md_file_path: Path):
+        '''
+        Records the size and mtime of a markdown file that has no image tags left
         '''
-        Reads a markdown file, finds image tags, gets description and overwrites the file
+
+        stat = md_file_path.stat()
+        self._done_marker_path(md_file_path).write_text(
+            f'{stat.st_size}:{stat.st_mtime_ns}', encoding='utf-8'
+        )
+
+    def _is_marked_done(self, md_file_path: Path) -> bool:
+        '''
+        Checks the done marker against the file's size and mtime, without reading the file
+        '''
+
+        marker_path = self._done_marker_path(md_file_path)
+        if not marker_path.is_file():
+            return False
+
+        stat = md_file_path.stat()
+        return marker_path.read_text(encoding='utf-8') == f'{stat.st_size}:{stat.st_mtime_ns}'
+
+    async def _adescribe_jobs(self, content: str,
+                              image_jobs: List[Tuple[int, int, ImageSource, str]]) -> str:
+        '''
+        Describes the images of (tag_start, tag_end, image, context) jobs in batches
+        and returns the content with each tag span replaced by its description
+        '''
+
+        batches = [
+            image_jobs[start:start + self.batch_size]
+            for start in range(0, len(image_jobs), self.batch_size)
+        ]
+        batch_results = await asyncio.gather(
+            *[
+                self._adescribe_images_batch(
+                    [(image_path, context) for _, _, image_path, context in batch]
+                )
+                for batch in batches
+            ],
+            return_exceptions=True
+        )
+        for result in batch_results:
+            if isinstance(result, BaseException):
+                raise result
+
+        # Single forward pass over the jobs, which are sorted by position
+        return self._splice_descriptions(
+            content,
+            ((tag_start, tag_end) for tag_start, tag_end, _, _ in image_jobs),
+            (description for result in batch_results for description in result)
+        )
+
+    async def aprocess_markdown_file(self, md_file_path: Path):
+        '''
+        Reads a markdown file, finds image tags, gets description and overwrites the file.
+        All descriptions of the file are requested concurrently
         '''
 
         logging.info('Processing markdown file: %s', md_file_path)
         try:
-            content = md_file_path.read_text(encoding='utf-8')
-            original_content = content
-            matches = list(self.image_tag_pattern.finditer(content))
+            if self._is_marked_done(md_file_path):
+                logging.info('  - Unchanged since last run, skipping: %s', md_file_path.name)
+                return
+
+            original_content = md_file_path.read_text(encoding='utf-8')
 
-            logging.info('  - Found %d image tags in %s', len(matches), md_file_path.name)
-            num_processed = 0
+            # Described files have no tags left, so a cheap search is the content-level
+            # check: nothing is rewritten and the marker is refreshed for the next run
+            if self.image_tag_pattern.search(original_content) is None:
+                logging.info('  - No image tags in %s', md_file_path.name)
+                self._mark_done(md_file_path)
+                return
 
-            for match in reversed(matches):
-                num_processed += 1
+            words, word_starts = self._split_words(original_content)
+
+            # Docling output often references the same image several times, so paths are
+            # resolved once per raw reference and existence is checked against one
+            # directory listing per image directory instead of a stat per tag
+            resolved_paths: Dict[str, Path] = {}
+            existing_files: Dict[Path, Set[str]] = {}
+
+            image_jobs = []  # list of tuples (tag_start, tag_end, image_path, context)
+            for match in self.image_tag_pattern.finditer(original_content):
                 alt_text = match.group(1)
                 relative_image_path_str = match.group(2)
-                tag_start, tag_end = match.span()
 
-                image_path = (md_file_path.parent / Path(relative_image_path_str)).resolve()
+                image_path = resolved_paths.get(relative_image_path_str)
+                if image_path is None:
+                    image_path = (md_file_path.parent / Path(relative_image_path_str)).resolve()
+                    resolved_paths[relative_image_path_str] = image_path
+
+                if image_path.parent not in existing_files:
+                    existing_files[image_path.parent] = self._list_files(image_path.parent)
+                if image_path.name not in existing_files[image_path.parent]:
+                    logging.error('    - Image file not found: %s', image_path)
+                    raise FileNotFoundError('Can\'t find the image file')
+
                 cleaned_context = self._extract_and_clean_context(
-                    original_content,
+                    words,
+                    word_starts,
                     match.start(),
                     match.end()
                 )
                 if not cleaned_context:
                     cleaned_context = alt_text if alt_text else 'No text context available'
 
-                description = self._describe_image(image_path, cleaned_context)
-                content = content[:tag_start] + description + content[tag_end:]
+                image_jobs.append((match.start(), match.end(), image_path, cleaned_context))
+
+            logging.info('  - Found %d image tags in %s', len(image_jobs), md_file_path.name)
+
+            # The word index is several times the size of the file; release it before
+            # awaiting the descriptions so concurrent files don't all hold one.
+            # original_content is the only copy kept for the final splice
+            del words, word_starts, resolved_paths, existing_files
+
+            content = await self._adescribe_jobs(original_content, image_jobs)
 
             md_file_path.write_text(content, encoding='utf-8')
+            self._mark_done(md_file_path)
             logging.info('  - Finished processing. Updated file saved: %s', md_file_path.name)
 
         except FileNotFoundError as fnf_err:
@@ -171,6 +625,83 @@ class MarkdownImageProcessor:
         except Exception as e:  # pylint: disable=broad-except
             logging.error('Failed to process file %s: %s', md_file_path, e, exc_info=True)
 
+    def process_markdown_file(self, md_file_path: Path):
+        '''
+        Synchronous wrapper around aprocess_markdown_file
+        '''
+
+        asyncio.run(self._run_pooled(self.aprocess_markdown_file(md_file_path)))
+
+    async def aprocess_in_memory(self, md_text: str, pictures: Sequence[Optional[bytes]],
+                                 output_md_path: Path, placeholder: str):
+        '''
+        Describes the pictures of a freshly converted document and writes the final
+        markdown once. Each occurrence of `placeholder` in md_text stands for the
+        picture at the same position in `pictures` (None if it has no image data),
+        so no markdown is read back from disk and no image tags are parsed
+        '''
+
+        logging.info('Processing converted document: %s', output_md_path.name)
+        try:
+            words, word_starts = self._split_words(md_text)
+
+            image_jobs = []  # list of tuples (tag_start, tag_end, image, context)
+            position = md_text.find(placeholder)
+            for picture_no, picture in enumerate(pictures):
+                if position < 0:
+                    raise ValueError('Fewer placeholders than pictures in the markdown')
+                span_start, span_end = position, position + len(placeholder)
+                position = md_text.find(placeholder, span_end)
+
+                if picture is None:
+                    continue
+
+                context = self._extract_and_clean_context(words, word_starts, span_start, span_end)
+                image = InMemoryImage(f'{output_md_path.stem}#picture{picture_no}', picture)
+                image_jobs.append(
+                    (span_start, span_end, image, context or 'No text context available')
+                )
+
+            logging.info('  - Found %d pictures in %s', len(image_jobs), output_md_path.name)
+            del words, word_starts
+
+            content = await self._adescribe_jobs(md_text, image_jobs)
+            # Only the placeholders of pictures without image data are left; they get
+            # the placeholder Docling itself would have written
+            content = content.replace(placeholder, '<!-- image -->')
+
+            output_md_path.parent.mkdir(parents=True, exist_ok=True)
+            output_md_path.write_text(content, encoding='utf-8')
+            self._mark_done(output_md_path)
+            logging.info('  - Finished processing. File saved: %s', output_md_path.name)
+
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error('Failed to process converted document %s: %s',
+                          output_md_path, e, exc_info=True)
+
+    def process_in_memory(self, md_text: str, pictures: Sequence[Optional[bytes]],
+                          output_md_path: Path, placeholder: str):
+        '''
+        Synchronous wrapper around aprocess_in_memory
+        '''
+
+        asyncio.run(self._run_pooled(
+            self.aprocess_in_memory(md_text, pictures, output_md_path, placeholder)
+        ))
+
+    async def _aprocess_dir(self, md_files: List[Path]):
+        '''
+        Processes the given markdown files concurrently on one event loop
+        '''
+
+        file_sem = asyncio.Semaphore(int(os.environ.get('MD_WORKERS', 8)))
+
+        async def process_one(md_file: Path):
+            async with file_sem:
+                await self.aprocess_markdown_file(md_file)
+
+        await asyncio.gather(*[process_one(md_file) for md_file in md_files])
+
     def process_dir(self, input_dir: Path):
         '''
         Finds all .md files in the input directory and processes them
@@ -180,10 +711,8 @@ class MarkdownImageProcessor:
             logging.error('Input path is not a valid directory: %s', input_dir)
             return
 
-        md_files_processed = 0
-        for md_file in input_dir.glob('*.md'):
-            self.process_markdown_file(md_file)
-            md_files_processed += 1
+        md_files = list(input_dir.glob('*.md'))
+        asyncio.run(self._run_pooled(self._aprocess_dir(md_files)))
 
         logging.info('Finished processing directory. %d markdown files processed',
-                     md_files_processed)
\ No newline at end of file
+                     len(md_files))
@@ -1,18 +1,26 @@
+import io
+import os
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional, List
+from typing import Callable, Dict, Iterator, Optional, List, Tuple
 
 from docling.datamodel.base_models import InputFormat
 from docling.datamodel.pipeline_options import (
+    AcceleratorDevice,
+    AcceleratorOptions,
     PdfPipelineOptions,
     TableFormerMode,
     EasyOcrOptions,
 )
 from docling.document_converter import DocumentConverter, PdfFormatOption
-from docling_core.types.doc import ImageRefMode
+from docling_core.types.doc import ImageRefMode, PictureItem
 
 DOCLING_AVAILABLE = True
 
+# Stands for a picture in markdown that is kept in memory; see convert_pdf_in_memory
+PICTURE_PLACEHOLDER = "<!-- picture -->"
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 
@@ -32,15 +40,21 @@ class PDFConverter:
 
     def _get_default_pdf_options(self) -> PdfPipelineOptions:
         """
-        Provides default configuration enabling OCR, tables and images.
+        Provides default configuration enabling tables and picture images.
+        Models run on the GPU when one is available; page images are not rendered
+        since only the referenced pictures are used downstream.
         """
-        logging.info("Using default Docling PDF options (OCR, Tables, Image enabled)")
+        logging.info("Using default Docling PDF options (Tables, Picture images enabled)")
         return PdfPipelineOptions(
             do_table_structure=True,
             do_ocr=False,
             ocr_options=EasyOcrOptions(force_full_page_ocr=True, lang=["en"]),
-            table_structure_options={"do_cell_matching": False, "mode": TableFormerMode.ACCURATE},
-            generate_page_images=True,
+            table_structure_options={"do_cell_matching": False, "mode": TableFormerMode.FAST},
+            accelerator_options=AcceleratorOptions(
+                num_threads=os.cpu_count() or 4,
+                device=AcceleratorDevice.AUTO,
+            ),
+            generate_page_images=False,
             generate_picture_images=True,
         )
 
@@ -81,16 +95,115 @@ class PDFConverter:
             logging.exception("Error converting %s with Docling", pdf_path.name)
             return None
 
-    def process_dir(self, input_dir: Path, output_dir: Path) -> List[Path]:
+    def convert_pdf_in_memory(self, pdf_path: Path) -> Optional[Tuple[str, List[Optional[bytes]]]]:
+        """
+        Converts a single PDF without writing anything to disk.
+        Returns the markdown, with every picture replaced by PICTURE_PLACEHOLDER, and the
+        PNG bytes of the pictures in the same order (None for pictures without image data).
+        """
+        if not pdf_path.is_file() or pdf_path.suffix.lower() != ".pdf":
+            logging.warning("Skipping non-PDF file: %s", pdf_path)
+            return None
+
+        logging.info("Starting in-memory Docling conversion for %s", pdf_path.name)
+        try:
+            result = self.doc_converter.convert(str(pdf_path))
+            if not result or not result.document:
+                logging.error("Docling conversion returned empty result for %s", pdf_path.name)
+                return None
+
+            document = result.document
+            md_text = document.export_to_markdown(
+                image_mode=ImageRefMode.PLACEHOLDER,
+                image_placeholder=PICTURE_PLACEHOLDER,
+            )
+
+            pictures = []
+            for item, _ in document.iterate_items():
+                if not isinstance(item, PictureItem):
+                    continue
+                image = item.get_image(document)
+                if image is None:
+                    pictures.append(None)
+                    continue
+                buffer = io.BytesIO()
+                image.save(buffer, format="PNG")
+                pictures.append(buffer.getvalue())
+
+            if md_text.count(PICTURE_PLACEHOLDER) != len(pictures):
+                logging.error("Pictures of %s don't line up with the markdown placeholders",
+                              pdf_path.name)
+                return None
+
+            return md_text, pictures
+
+        except Exception:
+            logging.exception("Error converting %s with Docling", pdf_path.name)
+            return None
+
+    def _map_pdfs(self, convert: Callable, worker_convert: Callable, pdf_files: List[Path],
+                  max_workers: Optional[int], *args, threads_per_worker: int = 2,
+                  doc_batch_size: int = 1) -> Iterator:
+        """
+        Yields convert(pdf_file, *args) for every PDF, in order. With more than one worker
+        the PDFs are converted in worker processes, each holding its own converter and
+        limited to threads_per_worker threads; doc_batch_size PDFs are sent per task.
+        """
+        if max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 2) // threads_per_worker)
+        max_workers = min(max_workers, len(pdf_files))
+
+        if max_workers <= 1:
+            for pdf_file in pdf_files:
+                yield convert(pdf_file, *args)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(self.converter_options, threads_per_worker),
+        ) as executor:
+            yield from executor.map(
+                worker_convert, pdf_files, *[[arg] * len(pdf_files) for arg in args],
+                chunksize=doc_batch_size,
+            )
+
+    def process_dir_in_memory(self, input_dir: Path, max_workers: Optional[int] = None,
+                              threads_per_worker: int = 2, doc_batch_size: int = 1
+                              ) -> Iterator[Tuple[Path, Tuple[str, List[Optional[bytes]]]]]:
+        """
+        Converts all PDFs in a directory in memory, yielding (pdf_path, (md_text, pictures))
+        as each conversion finishes in order. Failed conversions are skipped.
+        """
+        if not input_dir.is_dir():
+            logging.error("Input directory not found: %s", input_dir)
+            return
+
+        pdf_files = list(input_dir.glob("*.pdf"))
+        if not pdf_files:
+            logging.warning("No PDFs found in %s", input_dir)
+            return
+
+        logging.info("Found %d PDFs", len(pdf_files))
+        results = self._map_pdfs(
+            self.convert_pdf_in_memory, _convert_in_memory_in_worker, pdf_files, max_workers,
+            threads_per_worker=threads_per_worker, doc_batch_size=doc_batch_size,
+        )
+        for pdf_file, converted in zip(pdf_files, results):
+            if converted is not None:
+                yield pdf_file, converted
+
+    def process_dir(self, input_dir: Path, output_dir: Path, max_workers: Optional[int] = None,
+                    threads_per_worker: int = 2, doc_batch_size: int = 1) -> List[Path]:
         """
         Processes all PDFs in a directory using Docling.
+        PDFs are converted in parallel worker processes, each holding its own converter.
         """
         if not input_dir.is_dir():
             logging.error("Input directory not found: %s", input_dir)
             return []
 
         output_dir.mkdir(parents=True, exist_ok=True)
-        processed_files = []
 
         logging.info("Starting Docling PDF processing in directory %s", input_dir)
         pdf_files = list(input_dir.glob("*.pdf"))
@@ -101,11 +214,48 @@ class PDFConverter:
 
         logging.info("Found %d PDFs", len(pdf_files))
 
-        for pdf_file in pdf_files:
-            output_path = self.convert_pdf_to_md(pdf_file, output_dir)
-            if output_path:
-                processed_files.append(output_path)
+        output_paths = self._map_pdfs(
+            self.convert_pdf_to_md, _convert_in_worker, pdf_files, max_workers, output_dir,
+            threads_per_worker=threads_per_worker, doc_batch_size=doc_batch_size,
+        )
+        processed_files = [output_path for output_path in output_paths if output_path]
 
         logging.info("Finished Docling processing. Converted %d PDFs", len(processed_files))
 
-        return processed_files
\ No newline at end of file
+        return processed_files
+
+
+_worker_converter: Optional[PDFConverter] = None
+
+
+def _init_worker(pdf_options: PdfPipelineOptions, threads_per_worker: int):
+    """
+    Builds one converter per worker process so the Docling models are loaded once per worker.
+    The worker's torch/onnx runtimes are limited to threads_per_worker threads, so that
+    the workers together don't oversubscribe the cores.
+    """
+    global _worker_converter  # pylint: disable=global-statement
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_worker)
+    try:
+        import torch  # pylint: disable=import-outside-toplevel
+        torch.set_num_threads(threads_per_worker)
+    except ImportError:
+        pass
+
+    pdf_options = pdf_options.model_copy(deep=True)
+    pdf_options.accelerator_options.num_threads = threads_per_worker
+    _worker_converter = PDFConverter(pdf_options)
+
+
+def _convert_in_worker(pdf_path: Path, output_dir: Path) -> Optional[Path]:
+    """
+    Converts a single PDF with the converter of the current worker process.
+    """
+    return _worker_converter.convert_pdf_to_md(pdf_path, output_dir)
+
+
+def _convert_in_memory_in_worker(pdf_path: Path) -> Optional[Tuple[str, List[Optional[bytes]]]]:
+    """
+    Converts a single PDF in memory with the converter of the current worker process.
+    """
+    return _worker_converter.convert_pdf_in_memory(pdf_path)
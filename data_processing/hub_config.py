@@ -0,0 +1,51 @@
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+from gen_ai_hub.proxy.core.proxy_clients import get_proxy_client
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@dataclass(frozen=True, slots=True)
+class HubConfig:
+    '''
+    Connection settings for the Generative AI Hub, loaded once per pipeline run
+    '''
+    hub_base_url: str
+    hub_auth_url: str
+    hub_client_id: str
+    hub_client_secret: str
+
+    @classmethod
+    def from_credentials(cls, credentials_path: Path) -> 'HubConfig':
+        '''
+        Builds the config from a service key JSON file
+        '''
+        raw = Path(credentials_path).read_bytes()
+        creds = orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+        return cls(
+            hub_base_url=creds['serviceurls']['AI_API_URL'],
+            hub_auth_url=creds['url'],
+            hub_client_id=creds['clientid'],
+            hub_client_secret=creds['clientsecret'],
+        )
+
+
+@lru_cache(maxsize=None)
+def get_hub_proxy_client(config: HubConfig):
+    '''
+    Returns one proxy client per config, so every consumer shares its cached auth token
+    '''
+    return get_proxy_client(
+        proxy_version='gen-ai-hub',
+        base_url=config.hub_base_url,
+        auth_url=config.hub_auth_url,
+        client_id=config.hub_client_id,
+        client_secret=config.hub_client_secret
+    )
@@ -1,20 +1,105 @@
-import pickle
 import json
 import logging
 from typing import List
 from pathlib import Path
 
 from llama_index.core.schema import TextNode
+from pydantic import TypeAdapter
 from docling_converter import PDFConverter
 from describe import MarkdownImageProcessor
 from text_chunker import TextChunker
 from vectorizer import VectorIndex
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# One compiled validator for whole lists of nodes instead of a model_validate call per node
+TEXT_NODES_ADAPTER = TypeAdapter(List[TextNode])
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+
+def _dumps(obj) -> str:
+    '''
+    Serializes a JSON column value, with orjson when it is installed
+    '''
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def _loads(value):
+    '''
+    Parses a JSON column value, with orjson when it is installed
+    '''
+    return orjson.loads(value) if orjson is not None else json.loads(value)
+
+
+def save_chunks_parquet(nodes: List[TextNode], path: Path):
+    '''
+    Stores the chunks column-wise in a Snappy-compressed Parquet file
+    '''
+    table = pa.table({
+        'id': [node.node_id for node in nodes],
+        'text': [node.text for node in nodes],
+        'metadata_json': [_dumps(node.metadata) for node in nodes],
+        'relationships_json': [_dumps(node.to_dict()['relationships']) for node in nodes],
+    })
+    pq.write_table(table, path, compression='snappy')
+
+
+def load_chunks_parquet(path: Path) -> List[TextNode]:
+    '''
+    Loads the chunks written by save_chunks_parquet
+    '''
+    columns = pq.read_table(path, memory_map=True).to_pydict()
+    return TEXT_NODES_ADAPTER.validate_python([
+        {
+            'id_': node_id,
+            'text': text,
+            'metadata': _loads(metadata_json),
+            'relationships': _loads(relationships_json),
+        }
+        for node_id, text, metadata_json, relationships_json in zip(
+            columns['id'], columns['text'],
+            columns['metadata_json'], columns['relationships_json']
+        )
+    ])
+
+
+def save_chunks_json(nodes: List[TextNode], path: Path, indent: bool = False):
+    '''
+    Stores the chunks as a JSON list of node dicts, indented only for debugging
+    '''
+    serializable_chunks = [node.to_dict() for node in nodes]
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        path.write_bytes(orjson.dumps(serializable_chunks, option=option))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(serializable_chunks, f, indent=2 if indent else None)
+
+
+def load_chunks_json(path: Path) -> List[TextNode]:
+    '''
+    Loads the chunks written by save_chunks_json
+    '''
+    raw = path.read_bytes()
+    nodes_data = _loads(raw)
+    return TEXT_NODES_ADAPTER.validate_python(nodes_data)
+
+
 def main(modes: List[str] = []):
     '''
     1. Convert PDFs to MDs
@@ -25,7 +110,6 @@ def main(modes: List[str] = []):
     RAW_PDF_DIR = project_root / 'assets' / 'pdfs'
     MARKDOWN_OUTPUT_DIR = project_root / 'assets' / 'markdown'
     VECTOR_STORE_DIR = project_root / 'assets' / 'vector_store'
-    IRPA_JSON = project_root / 'assets' / 'secterts' / 'credentials.json'
 
     EMBEDDING_MODEL_NAME = 'BAAI/bge-base-en-v1.5'
     EMBEDDING_DIM = 768
@@ -37,14 +121,7 @@ def main(modes: List[str] = []):
     FORCE_REPARSE_PDF = False
     FORCE_RECHUNK = False
     FORCE_REINDEX = False
-
-    with open(IRPA_JSON, 'r') as f:
-        creds = json.load(f)
-
-    hub_base_url = creds.get('serviceurls', {}).get('AI_API_URL')
-    hub_auth_url = creds.get('url')
-    hub_client_id = creds.get('clientid')
-    hub_client_secret = creds.get('clientsecret')
+    WRITE_DEBUG_JSON = False
 
     if not RAW_PDF_DIR.exists() and not MARKDOWN_OUTPUT_DIR.exists():
         logging.error(
@@ -85,19 +162,33 @@ def main(modes: List[str] = []):
             else:
                 try:
                     # Uncomment to activate
+                    # Conversion and image description run as one stage: pictures are
+                    # described straight from the converted documents and each MD is
+                    # written once, instead of being written, re-read and rewritten.
+                    # The hub credentials are only needed here, so they are loaded here
+                    # from hub_config import HubConfig, get_hub_proxy_client
+                    # from docling_converter import PICTURE_PLACEHOLDER
+                    # PDFs are converted by os.cpu_count() // PDF_THREADS_PER_WORKER processes
+                    # PDF_THREADS_PER_WORKER = 2
+                    # PDF_DOC_BATCH_SIZE = 1
+                    # IRPA_JSON = project_root / 'assets' / 'secterts' / 'credentials.json'
+                    # hub_config = HubConfig.from_credentials(IRPA_JSON)
                     # converter = PDFConverter()
-                    # mds_generated = converter.process_dir(
-                    #     RAW_PDF_DIR, MARKDOWN_OUTPUT_DIR
-                    # )
-                    #
                     # processor = MarkdownImageProcessor(
-                    #     hub_base_url=hub_base_url,
-                    #     hub_auth_url=hub_auth_url,
-                    #     hub_client_id=hub_client_id,
-                    #     hub_client_secret=hub_client_secret,
+                    #     hub_config=hub_config,
+                    #     proxy_client=get_hub_proxy_client(hub_config),
                     #     context_words=150
                     # )
-                    # processor.process_dir(MARKDOWN_OUTPUT_DIR)
+                    # for pdf_path, (md_text, pictures) in converter.process_dir_in_memory(
+                    #     RAW_PDF_DIR,
+                    #     threads_per_worker=PDF_THREADS_PER_WORKER,
+                    #     doc_batch_size=PDF_DOC_BATCH_SIZE
+                    # ):
+                    #     md_path = MARKDOWN_OUTPUT_DIR / (pdf_path.stem + '.md')
+                    #     processor.process_in_memory(
+                    #         md_text, pictures, md_path, PICTURE_PLACEHOLDER
+                    #     )
+                    #     markdown_files_generated_or_found.append(md_path)
 
                     logging.info(
                         'Docling conversion finished. Found %d MDs',
@@ -151,20 +242,23 @@ def main(modes: List[str] = []):
                 )
 
         if all_nodes:
-            chunks_path1 = project_root / 'assets' / 'chunks' / 'chunks.pkl'
+            chunks_path1 = project_root / 'assets' / 'chunks' / 'chunks.parquet'
             chunks_path2 = project_root / 'assets' / 'chunks' / 'chunks.json'
 
             logging.info('Saving %d chunks to %s', len(all_nodes), chunks_path1)
 
             try:
-                with open(chunks_path1, 'wb') as f:
-                    pickle.dump(all_nodes, f)
-                print('Successfully saved chunks (pickle)')
+                if pq is not None:
+                    save_chunks_parquet(all_nodes, chunks_path1)
+                    print('Successfully saved chunks (parquet)')
+                else:
+                    logging.warning('pyarrow is not installed, saving chunks as JSON only')
 
-                serializable_chunks = [node.to_dict() for node in all_nodes]
-                with open(chunks_path2, 'w', encoding='utf-8') as f:
-                    json.dump(serializable_chunks, f, indent=2)
-                print('Successfully saved chunks (json)')
+                # Parquet is the canonical format; the JSON copy is only written as a
+                # fallback or, indented, for inspection
+                if pq is None or WRITE_DEBUG_JSON:
+                    save_chunks_json(all_nodes, chunks_path2, indent=WRITE_DEBUG_JSON)
+                    print('Successfully saved chunks (json)')
 
             except Exception as e:
                 logging.error('Failed to save chunks: %s', e, exc_info=True)
@@ -172,12 +266,12 @@ def main(modes: List[str] = []):
     # --- Step 3: Embedding & Indexing ---
     if 'vectorize' in modes or not modes:
         if not all_nodes:
+            chunks_parquet = project_root / 'assets' / 'chunks' / 'chunks.parquet'
             chunks_json = project_root / 'assets' / 'chunks' / 'chunks.json'
-            with open(chunks_json, 'r', encoding='utf-8') as f:
-                nodes_data = json.load(f)
-                for node_dict in nodes_data:
-                    node = TextNode.model_validate(node_dict)
-                    all_nodes.append(node)
+            if pq is not None and chunks_parquet.exists():
+                all_nodes = load_chunks_parquet(chunks_parquet)
+            else:
+                all_nodes = load_chunks_json(chunks_json)
 
         vector_index = VectorIndex(
             embedding_model_name=EMBEDDING_MODEL_NAME,
@@ -0,0 +1,154 @@
+import os
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.embeddings.huggingface.utils import get_query_instruct_for_model_name
+from transformers import AutoTokenizer
+
+try:
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTOptimizer, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoOptimizationConfig, AutoQuantizationConfig
+except ImportError:
+    ort = ORTModelForFeatureExtraction = ORTOptimizer = ORTQuantizer = None
+
+# Where export_onnx_model writes the export when no other directory is configured
+DEFAULT_ONNX_MODEL_DIR = Path(__file__).parent.parent / 'assets' / 'onnx_model'
+
+
+def export_onnx_model(model_name: str, output_dir: Path, quantize: bool = True) -> Path:
+    '''
+    Exports the HuggingFace model to ONNX, applies the O3 graph optimizations and,
+    with quantize, dynamic int8 quantization. The result is written to
+    output_dir/model.onnx once; later calls return the cached export
+    '''
+    output_dir = Path(output_dir)
+    if (output_dir / 'model.onnx').is_file():
+        return output_dir
+    if ORTModelForFeatureExtraction is None:
+        raise ImportError('Exporting to ONNX needs `optimum[onnxruntime]` installed')
+
+    logging.info('Exporting %s to ONNX in %s', model_name, output_dir)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+
+        ORTOptimizer.from_pretrained(model).optimize(
+            save_dir=tmp / 'optimized',
+            optimization_config=AutoOptimizationConfig.O3()
+        )
+        final_dir, final_file = tmp / 'optimized', 'model_optimized.onnx'
+
+        if quantize:
+            quantizer = ORTQuantizer.from_pretrained(final_dir, file_name=final_file)
+            quantizer.quantize(
+                save_dir=tmp / 'quantized',
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False,
+                                                                       per_channel=False)
+            )
+            final_dir, final_file = tmp / 'quantized', 'model_optimized_quantized.onnx'
+
+        output_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copy(final_dir / 'config.json', output_dir / 'config.json')
+        shutil.copy(final_dir / final_file, output_dir / 'model.onnx')
+
+    logging.info('ONNX export of %s written to %s', model_name, output_dir)
+    return output_dir
+
+
+class OnnxEmbedding(BaseEmbedding):
+    '''
+    BGE embedding model served by ONNX Runtime on CPU, typically an int8-quantized export:
+
+        optimum-cli export onnx --model BAAI/bge-base-en-v1.5 bge_onnx/
+        optimum-cli onnxruntime quantize --avx512_vnni --onnx_model bge_onnx/ -o bge_int8/
+
+    Uses CLS pooling and takes the query instruction for tokenizer_name from the same
+    table HuggingFaceEmbedding uses, so both backends produce interchangeable vectors
+    '''
+    model_path: str = Field(description='Directory of the exported ONNX model')
+    tokenizer_name: str = Field(default='BAAI/bge-base-en-v1.5')
+    query_instruction: str = Field(default='')
+    max_length: int = Field(default=512)
+    normalize: bool = Field(default=True)
+
+    _model: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+
+    def __init__(
+        self,
+        model_path: str,
+        tokenizer_name: str = 'BAAI/bge-base-en-v1.5',
+        file_name: Optional[str] = None,
+        num_threads: Optional[int] = None,
+        **kwargs: Any
+    ):
+        if ORTModelForFeatureExtraction is None:
+            raise ImportError('The ONNX backend needs `optimum[onnxruntime]` installed')
+
+        kwargs.setdefault('query_instruction', get_query_instruct_for_model_name(tokenizer_name))
+        super().__init__(
+            model_name=str(model_path),
+            model_path=str(model_path),
+            tokenizer_name=tokenizer_name,
+            **kwargs
+        )
+
+        # Leave half of the cores to the rest of the process
+        sess_options = ort.SessionOptions()
+        sess_options.intra_op_num_threads = num_threads or max(1, (os.cpu_count() or 2) // 2)
+
+        self._model = ORTModelForFeatureExtraction.from_pretrained(
+            str(model_path),
+            file_name=file_name,
+            session_options=sess_options,
+            provider='CPUExecutionProvider'
+        )
+        self._tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        logging.info('ONNX embedding model loaded from %s with %d threads',
+                     model_path, sess_options.intra_op_num_threads)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'OnnxEmbedding'
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        '''
+        Encodes the texts in length-sorted batches to keep padding low
+        '''
+        order = np.argsort([len(text) for text in texts])
+        embeddings = np.empty((len(texts), self._model.config.hidden_size), dtype='float32')
+
+        for start in range(0, len(texts), self.embed_batch_size):
+            batch_ids = order[start:start + self.embed_batch_size]
+            inputs = self._tokenizer(
+                [texts[i] for i in batch_ids],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors='np'
+            )
+            outputs = self._model(**inputs)
+            embeddings[batch_ids] = outputs.last_hidden_state[:, 0]
+
+        if self.normalize:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._encode([self.query_instruction + query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(texts)
@@ -1,11 +1,12 @@
+import hashlib
 import logging
-import uuid
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 
-from llama_index.core.node_parser import MarkdownNodeParser
-from llama_index.core.schema import Document, TextNode
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from llama_index.core.schema import NodeRelationship, TextNode
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.getLogger().setLevel(logging.INFO)
@@ -14,10 +15,31 @@ MIN_CHUNK_SIZE = 250
 MAX_CHUNK_SIZE = 1500
 CHUNK_OVERLAP = 150
 
+# Separators tried in order when a chunk has to be cut
+SEPARATORS = ['\n\n', '\n', '. ', '? ', '! ', '... ', ' ']
+
+# Code fences and ATX headings, the only lines that start a new section
+SECTION_RE = re.compile(r'^[^\S\n]*```.*$|^(#+)[^\S\n](.*)$', re.MULTILINE)
+
+# In priority order: the first model found in the text or the filename wins
+KNOWN_MODELS = ['Ford Mustang', 'Daewoo Matiz', 'Honda', 'Subaru', 'Ford', 'Volkswagen']
+MODEL_RE = re.compile('|'.join(re.escape(model) for model in KNOWN_MODELS), re.IGNORECASE)
+
+def mentioned_model(*texts: str) -> Optional[str]:
+    '''Returns the highest-priority known model mentioned in any of the texts, or None.'''
+
+    # One case-insensitive scan per text collects every mention, without lowercasing it
+    found = {match.lower() for text in texts for match in MODEL_RE.findall(text)}
+    for model in KNOWN_MODELS:
+        if model.lower() in found:
+            return model
+    return None
+
 class TextChunker:
     '''
-    Chunks Markdown text into structured nodes using MarkdownNodeParser,
-    then applies LangChain's RecursiveCharacterTextSplitter to enforce size bounds.
+    Chunks Markdown text into heading sections, merges small sections and then
+    cuts them at the coarsest separator to enforce size bounds.
+    Both steps are single passes over the text.
     '''
 
     def __init__(
@@ -28,30 +50,111 @@ class TextChunker:
         max_chunk_size_chars: int = MAX_CHUNK_SIZE,
         chunk_overlap: int = CHUNK_OVERLAP,
     ):
-        self.node_parser = MarkdownNodeParser(
-            include_metadata=include_metadata,
-            include_prev_next_rel=include_prev_next_rel
-        )
+        # Kept so worker processes can build an identical chunker
+        self._init_kwargs = {
+            'include_metadata': include_metadata,
+            'include_prev_next_rel': include_prev_next_rel,
+            'min_chunk_size_chars': min_chunk_size_chars,
+            'max_chunk_size_chars': max_chunk_size_chars,
+            'chunk_overlap': chunk_overlap,
+        }
 
-        self.splitter = RecursiveCharacterTextSplitter(
-            chunk_size=max_chunk_size_chars,
-            chunk_overlap=chunk_overlap,
-            separators=['\n\n', '\n', '. ', '? ', '! ', '... ', ' ']
-        )
+        self.include_metadata = include_metadata
+        self.include_prev_next_rel = include_prev_next_rel
+        self.max_chunk_size = max_chunk_size_chars
+        self.chunk_overlap = chunk_overlap
 
         self.min_chunk_size = min_chunk_size_chars
-        logging.info('TextChunker initialized with recursive splitter')
+        logging.info('TextChunker initialized with single-pass splitter')
 
     def _extract_model_name(self, text: str, filename: str) -> str:
         '''Detect car model from text or filename. Defaults to 'Volkswagen'.'''
 
-        known_models = ['Ford Mustang', 'Daewoo Matiz', 'Honda', 'Subaru', 'Ford', 'Volkswagen']
-        text_norm = text.lower()
-        fn_norm = filename.lower().replace('-', ' ').replace('_', ' ')
-        for model in known_models:
-            if model.lower() in text_norm or model.lower() in fn_norm:
-                return model
-        return 'Volkswagen'
+        model = mentioned_model(text, filename.replace('-', ' ').replace('_', ' '))
+        return model or 'Volkswagen'
+
+    @staticmethod
+    def _chunk_id(file_name: str, chunk: str) -> str:
+        '''Deterministic node id from the source file name and the chunk text.'''
+
+        digest = hashlib.blake2b(file_name.encode('utf-8'), digest_size=16)
+        digest.update(b'\0')
+        digest.update(chunk.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _split_sections(self, content: str, file_name: str) -> List[Tuple[str, Dict[str, Any]]]:
+        '''Split Markdown into (text, metadata) sections, one per heading.
+        Headings inside code fences are ignored; the metadata holds the path of
+        parent headings like '/Heading 1/Heading 2/'.'''
+
+        sections = []
+        header_stack: List[Tuple[int, str]] = []
+        section_start = 0
+        section_head = ''
+        section_path = '/'
+        code_block = False
+
+        def add_section(end: int):
+            text = (section_head + content[section_start:end]).strip()
+            if text:
+                meta = {'file_name': file_name}
+                if self.include_metadata:
+                    meta['header_path'] = section_path
+                sections.append((text, meta))
+
+        for match in SECTION_RE.finditer(content):
+            if match.group(1) is None:
+                code_block = not code_block
+                continue
+            if code_block:
+                continue
+
+            add_section(match.start())
+
+            level = len(match.group(1))
+            while header_stack and header_stack[-1][0] >= level:
+                header_stack.pop()
+            parents = [header for _, header in header_stack]
+            section_path = '/' + '/'.join(parents) + '/' if parents else '/'
+            header_stack.append((level, match.group(2)))
+
+            section_head = '#' * level + ' ' + match.group(2)
+            section_start = match.end()
+
+        add_section(len(content))
+        return sections
+
+    def _split_text(self, text: str) -> List[str]:
+        '''Greedily cut text into chunks of at most max_chunk_size characters.
+        Each cut is made after the last occurrence of the coarsest separator
+        inside the window, and consecutive chunks share up to chunk_overlap characters.'''
+
+        chunks = []
+        start = 0
+        while len(text) - start > self.max_chunk_size:
+            window_end = start + self.max_chunk_size
+            cut = window_end
+            for separator in SEPARATORS:
+                position = text.rfind(separator, start + 1, window_end)
+                if position != -1:
+                    cut = position + len(separator)
+                    break
+
+            chunk = text[start:cut].strip()
+            if chunk:
+                chunks.append(chunk)
+
+            # Start the overlap on a word boundary, and always move forward
+            next_start = cut - self.chunk_overlap
+            if next_start > start:
+                space = text.find(' ', next_start, cut)
+                next_start = space + 1 if space != -1 else next_start
+            start = next_start if start < next_start < cut else cut
+
+        chunk = text[start:].strip()
+        if chunk:
+            chunks.append(chunk)
+        return chunks
 
     def chunk_markdown_file(self, md_path: Path) -> Optional[List[TextNode]]:
         '''Split a Markdown file into size-bounded TextNode chunks.'''
@@ -65,37 +168,46 @@ class TextChunker:
             content = md_path.read_text(encoding='utf-8', errors='ignore')
             model_name = self._extract_model_name(content, md_path.name)
 
-            doc = Document(text=content, metadata={'file_name': md_path.name})
-            nodes = self.node_parser.get_nodes_from_documents([doc])
+            sections = self._split_sections(content, md_path.name)
 
             merged_buffers = []  # list of tuples (text, metadata)
-            buffer_text = ''
+            buffer_parts: List[str] = []
+            buffer_len = 0  # length of '\n\n'.join(buffer_parts), kept incrementally
             buffer_meta: Dict[str, Any] = {}
 
-            for node in nodes:
-                node_text = node.get_text().strip()
-                if not buffer_text:
-                    buffer_text = node_text
-                    buffer_meta = node.metadata.copy()
+            for node_text, node_meta in sections:
+                if not buffer_parts:
+                    buffer_parts = [node_text]
+                    buffer_len = len(node_text)
+                    buffer_meta = node_meta
+                elif buffer_len < self.min_chunk_size:
+                    buffer_parts.append(node_text)
+                    buffer_len += 2 + len(node_text)
                 else:
-                    if len(buffer_text) < self.min_chunk_size:
-                        buffer_text += '\n\n' + node_text
-                    else:
-                        merged_buffers.append((buffer_text, buffer_meta))
-                        buffer_text = node_text
-                        buffer_meta = node.metadata.copy()
+                    merged_buffers.append(('\n\n'.join(buffer_parts), buffer_meta))
+                    buffer_parts = [node_text]
+                    buffer_len = len(node_text)
+                    buffer_meta = node_meta
 
-            if buffer_text:
-                merged_buffers.append((buffer_text, buffer_meta))
+            if buffer_parts:
+                merged_buffers.append(('\n\n'.join(buffer_parts), buffer_meta))
 
             final_nodes: List[TextNode] = []
+            seen_ids = set()
             for buf_text, meta in merged_buffers:
                 full_text = f'Car model: {model_name}\n\n{buf_text}'
-                chunks = self.splitter.split_text(full_text)
+                chunks = self._split_text(full_text)
 
                 for chunk in chunks:
+                    # Content-addressed ids keep re-chunking idempotent and drop
+                    # repeated chunks within the file
+                    node_id = self._chunk_id(md_path.name, chunk)
+                    if node_id in seen_ids:
+                        continue
+                    seen_ids.add(node_id)
+
                     node = TextNode(
-                        id_=str(uuid.uuid4()),
+                        id_=node_id,
                         text=chunk,
                         metadata={**meta, 'car_model': model_name},
                         start_char_idx=None,
@@ -105,6 +217,14 @@ class TextChunker:
                     )
                     final_nodes.append(node)
 
+            if self.include_prev_next_rel:
+                # Links consecutive chunks of the file, as MarkdownNodeParser did
+                for prev_node, next_node in zip(final_nodes, final_nodes[1:]):
+                    prev_node.relationships[NodeRelationship.NEXT] = \
+                        next_node.as_related_node_info()
+                    next_node.relationships[NodeRelationship.PREVIOUS] = \
+                        prev_node.as_related_node_info()
+
             logging.info('Produced %d chunks for %s', len(final_nodes), md_path.name)
             return final_nodes
 
@@ -112,19 +232,49 @@ class TextChunker:
             logging.error('Error processing %s: %s', md_path.name, e, exc_info=True)
             return None
 
-    def chunk_dir(self, dir: Path) -> Dict[str, List[TextNode]]:
-        '''Process all Markdown files in a directory.'''
+    def chunk_dir(self, dir: Path, max_workers: Optional[int] = None) -> Dict[str, List[TextNode]]:
+        '''Process all Markdown files in a directory, one file per worker process.'''
 
         if not dir.is_dir():
             logging.error('Directory not found: %s', dir)
             return {}
 
+        md_files = list(dir.glob('*.md'))
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        max_workers = min(max_workers, len(md_files))
+
+        if max_workers <= 1:
+            results = [self.chunk_markdown_file(md_file) for md_file in md_files]
+        else:
+            with ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_worker,
+                initargs=(self._init_kwargs,)
+            ) as executor:
+                results = list(executor.map(_chunk_in_worker, md_files))
+
         all_chunks = {}
-        for md_file in dir.glob('*.md'):
-            chunks = self.chunk_markdown_file(md_file)
+        for md_file, chunks in zip(md_files, results):
             if chunks:
                 all_chunks[md_file.name] = chunks
 
         total = sum(len(c) for c in all_chunks.values())
         logging.info('Total chunks across directory: %d', total)
         return all_chunks
+
+
+_worker_chunker: Optional[TextChunker] = None
+
+
+def _init_worker(chunker_kwargs: Dict[str, Any]):
+    '''Builds the chunker once per worker process.'''
+
+    global _worker_chunker  # pylint: disable=global-statement
+    _worker_chunker = TextChunker(**chunker_kwargs)
+
+
+def _chunk_in_worker(md_path: Path) -> Optional[List[TextNode]]:
+    '''Chunks a single file with the chunker of the current worker process.'''
+
+    return _worker_chunker.chunk_markdown_file(md_path)
@@ -1,21 +1,89 @@
 from pathlib import Path
 from typing import List, Optional
 import logging
+import os
 import faiss
 import numpy as np
+import torch
 
 from llama_index.core import (
     VectorStoreIndex,
     StorageContext,
     load_index_from_storage
 )
-from llama_index.core.schema import BaseNode
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import BaseNode, MetadataMode
 from llama_index.vector_stores.faiss import FaissVectorStore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 
+# Imported both as part of the data_processing package and as a sibling script module
+try:
+    from data_processing.onnx_embedding import (DEFAULT_ONNX_MODEL_DIR, OnnxEmbedding,
+                                                export_onnx_model)
+except ImportError:
+    from onnx_embedding import DEFAULT_ONNX_MODEL_DIR, OnnxEmbedding, export_onnx_model
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
+def default_embed_device() -> str:
+    '''
+    Picks the fastest available device for the embedding model
+    '''
+    if torch.cuda.is_available():
+        return 'cuda'
+    if torch.backends.mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+
+def half_embed_model(model: HuggingFaceEmbedding, device: Optional[str]):
+    '''
+    Casts the embedding model to fp16 on accelerators (cuda, mps), where it roughly
+    doubles encoder throughput and halves memory at no retrieval cost.
+    Shared by indexing and querying so both embed with the same precision
+    '''
+    if device in ('cuda', 'mps'):
+        model._model.half()  # pylint: disable=protected-access
+
+
+def compile_embed_model(model: HuggingFaceEmbedding, device: Optional[str]):
+    '''
+    Compiles the transformer of the embedding model with torch.compile on CUDA.
+    Shapes are marked dynamic since batches are padded to varying lengths
+    '''
+    if device != 'cuda':
+        return
+
+    try:
+        transformer = model._model[0]  # pylint: disable=protected-access
+        transformer.auto_model = torch.compile(transformer.auto_model, dynamic=True)
+        logging.info('Compiled the embedding model with torch.compile')
+    except Exception as e:
+        logging.warning('torch.compile failed, using the eager model: %s', e)
+
+
+def prefetch_files(paths: List[Path]):
+    '''
+    Asks the kernel to start reading the files into the page cache in the background,
+    so the reads that follow overlap with each other instead of waiting on the disk
+    one file at a time. A no-op where posix_fadvise is not available
+    '''
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError as e:
+            logging.debug('posix_fadvise failed for %s: %s', path, e)
+        finally:
+            os.close(fd)
+
+
 class VectorIndex:
     '''
     Builds and loads a FAISS VectorStoreIndex
@@ -29,30 +97,79 @@ class VectorIndex:
         embed_model_kwargs: Optional[dict] = None,
         embed_device: Optional[str] = None,
         ivf_nlist: int = 256,
-        ivf_nprobe: int = 16
+        ivf_nprobe: int = 32,
+        pq_m: int = 96,
+        pq_nbits: int = 8,
+        refine_k_factor: Optional[float] = None,
+        train_sample_size: int = 200_000,
+        insert_batch_size: int = 10_000,
+        mmap_index: bool = True,
+        hnsw_max_vectors: int = 100_000,
+        hnsw_m: int = 32,
+        hnsw_ef_construction: int = 200,
+        hnsw_ef_search: int = 64,
+        vector_dtype: str = 'i8',
+        index_type: str = 'HNSW',
+        embed_backend: str = 'torch',
+        onnx_model_path: Optional[Path] = None,
+        embed_model: Optional[BaseEmbedding] = None
     ):
+        '''
+        An already initialized embed_model is used as is instead of loading a new one
+        '''
         self.embedding_model_name = embedding_model_name
         self.embedding_dim = embedding_dim
         self.vector_store_path = vector_store_path
         self.embed_model_kwargs = embed_model_kwargs
-        self.embed_device = embed_device
-        self.embed_model = self._initialize_embed_model()
+        self.embed_device = embed_device or default_embed_device()
+        self.embed_backend = embed_backend
+        self.onnx_model_path = onnx_model_path
+        self.embed_model = (embed_model if embed_model is not None
+                            else self._initialize_embed_model())
 
         self.ivf_nlist = ivf_nlist
         self.ivf_nprobe = ivf_nprobe
-
-    def _initialize_embed_model(self) -> Optional[HuggingFaceEmbedding]:
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.refine_k_factor = refine_k_factor
+        self.train_sample_size = train_sample_size
+        self.insert_batch_size = insert_batch_size
+        self.mmap_index = mmap_index
+        self.hnsw_max_vectors = hnsw_max_vectors
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self.vector_dtype = vector_dtype
+        # 'HNSW', 'IVF', or 'auto' for HNSW below hnsw_max_vectors and IVF above
+        self.index_type = index_type
+
+    def _initialize_embed_model(self) -> Optional[BaseEmbedding]:
         '''
-        Initializes the HuggingFace embedding model
+        Initializes the HuggingFace embedding model, or its ONNX Runtime export
+        when embed_backend is 'onnx'. Without an onnx_model_path the model is exported
+        to DEFAULT_ONNX_MODEL_DIR on first use, as search.initialize_embed_model does
         '''
-        logging.info('Initializing HuggingFace embedding model: %s', self.embedding_model_name)
+        logging.info('Initializing %s embedding model: %s',
+                     self.embed_backend, self.embedding_model_name)
 
         try:
-            model = HuggingFaceEmbedding(
-                model_name=self.embedding_model_name,
-                device=self.embed_device,
-                model_kwargs=self.embed_model_kwargs
-            )
+            if self.embed_backend == 'onnx':
+                model_path = self.onnx_model_path or export_onnx_model(
+                    self.embedding_model_name, DEFAULT_ONNX_MODEL_DIR
+                )
+                model = OnnxEmbedding(
+                    model_path=str(model_path),
+                    tokenizer_name=self.embedding_model_name
+                )
+            else:
+                model = HuggingFaceEmbedding(
+                    model_name=self.embedding_model_name,
+                    device=self.embed_device,
+                    model_kwargs=self.embed_model_kwargs,
+                    normalize=True
+                )
+                half_embed_model(model, self.embed_device)
+                compile_embed_model(model, self.embed_device)
 
             test_emb = model.get_text_embedding('test')
             detected_dim = len(test_emb)
@@ -73,6 +190,106 @@ class VectorIndex:
 
         return model
 
+    def _set_nprobe(self, faiss_index: faiss.Index):
+        '''
+        Sets the number of probed lists on the IVF part of the index, if it has one
+        '''
+        try:
+            faiss.extract_index_ivf(faiss_index).nprobe = self.ivf_nprobe
+        except RuntimeError:
+            logging.info('FAISS index is not an IVF index, nprobe not applied')
+
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        '''
+        Encodes the texts directly with the underlying SentenceTransformer.
+        encode() sorts the texts by length before batching, so each batch is padded
+        to similar lengths, and returns the embeddings in the original order.
+        Other backends go through get_text_embedding_batch
+        '''
+        if not isinstance(self.embed_model, HuggingFaceEmbedding):
+            return np.asarray(
+                self.embed_model.get_text_embedding_batch(texts, show_progress=True),
+                dtype='float32'
+            )
+
+        model = self.embed_model._model  # pylint: disable=protected-access
+        batch_size = 64 if model.device.type == 'cuda' else 32
+
+        embeddings = model.encode(
+            texts,
+            batch_size=batch_size,
+            prompt_name='text',
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=True
+        )
+        return np.ascontiguousarray(embeddings, dtype='float32')
+
+    def _new_faiss_index(self, n_vectors: int) -> faiss.Index:
+        '''
+        Builds an empty FAISS index of index_type, suited to the corpus size.
+        BGE embeddings are unit-normalized, so inner product is cosine similarity
+        '''
+        if self.index_type == 'HNSW' or (self.index_type == 'auto'
+                                         and n_vectors < self.hnsw_max_vectors):
+            # HNSW beats IVF on recall and latency up to millions of vectors
+            if self.vector_dtype == 'i8':
+                # 8-bit scalar quantization stores 1 byte per dimension instead of 4;
+                # the per-dimension ranges are learned in a quick training pass
+                faiss_index = faiss.IndexHNSWSQ(self.embedding_dim, faiss.ScalarQuantizer.QT_8bit,
+                                                self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            else:
+                faiss_index = faiss.IndexHNSWFlat(self.embedding_dim, self.hnsw_m,
+                                                  faiss.METRIC_INNER_PRODUCT)
+            faiss_index.hnsw.efConstruction = self.hnsw_ef_construction
+            faiss_index.hnsw.efSearch = self.hnsw_ef_search
+            logging.info('Initialized FAISS index (%s, M=%d) with dimension %d',
+                          type(faiss_index).__name__, self.hnsw_m, self.embedding_dim)
+            if self.vector_dtype == 'i8' and self.refine_k_factor:
+                # Re-scores the int8 candidates with the full-precision vectors
+                faiss_index = faiss.IndexRefineFlat(faiss_index)
+                faiss_index.k_factor = self.refine_k_factor
+            return faiss_index
+
+        # Product quantization stores pq_m bytes per vector (pq_nbits=8) instead of
+        # 4 * embedding_dim, so the lists scanned per query are several times smaller
+        quantizer = faiss.IndexFlatIP(self.embedding_dim)
+        faiss_index = faiss.IndexIVFPQ(quantizer, self.embedding_dim, self.ivf_nlist,
+                                       self.pq_m, self.pq_nbits, faiss.METRIC_INNER_PRODUCT)
+        if self.refine_k_factor:
+            # Re-ranks refine_k_factor * k PQ candidates with exact distances,
+            # at the cost of also keeping the full vectors
+            faiss_index = faiss.IndexRefineFlat(faiss_index)
+            faiss_index.k_factor = self.refine_k_factor
+        self._set_nprobe(faiss_index)
+        logging.info('Initialized FAISS index (IndexIVFPQ, M=%d, nbits=%d) with dimension %d',
+                      self.pq_m, self.pq_nbits, self.embedding_dim)
+        return faiss_index
+
+    def _embed_nodes(self, nodes: List[BaseNode]) -> np.ndarray:
+        '''
+        Embeds the nodes from the same metadata-inclusive content the index would embed
+        '''
+        embeddings = self._embed_texts(
+            [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        )
+        faiss.normalize_L2(embeddings)
+        return embeddings
+
+    def _read_faiss_index(self, faiss_index_path: Path) -> faiss.Index:
+        '''
+        Reads the FAISS index, memory-mapping it read-only when enabled so only the
+        inverted lists touched by queries are paged in
+        '''
+        if self.mmap_index:
+            try:
+                return faiss.read_index(str(faiss_index_path),
+                                        faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                logging.warning('Could not memory-map %s, reading it fully: %s',
+                                faiss_index_path, e)
+        return faiss.read_index(str(faiss_index_path))
+
     def _load_index(self) -> Optional[VectorStoreIndex]:
         '''
         Attempts to load an existing index
@@ -88,7 +305,11 @@ class VectorIndex:
             if not faiss_index_path.exists():
                 raise FileNotFoundError(f'FAISS index file not found: {faiss_index_path}')
 
-            faiss_index = faiss.read_index(str(faiss_index_path))
+            # Readahead of the JSON stores runs while the FAISS index is being read
+            prefetch_files([faiss_index_path, *self.vector_store_path.glob('*.json')])
+
+            faiss_index = self._read_faiss_index(faiss_index_path)
+            self._set_nprobe(faiss_index)
             vector_store = FaissVectorStore(faiss_index=faiss_index)
 
             storage_context = StorageContext.from_defaults(
@@ -126,34 +347,55 @@ class VectorIndex:
         self.vector_store_path.mkdir(parents=True, exist_ok=True)
 
         try:
-            quantizer = faiss.IndexFlatL2(self.embedding_dim)
-            faiss_index = faiss.IndexIVFFlat(quantizer,
-            self.embedding_dim, self.ivf_nlist, faiss.METRIC_L2)
-            faiss_index.nprobe = self.ivf_nprobe
-            logging.info('Initialized FAISS index (IndexIVFFlat) with dimension %d',
-                          self.embedding_dim)
-
-            texts = [node.get_content() for node in nodes]
-            embeddings = np.array(self.embed_model.get_text_embedding_batch(texts,
-            show_progress=True), dtype='float32')
+            faiss_index = self._new_faiss_index(len(nodes))
+
+            # Small corpora are embedded once and the vectors reused for training;
+            # larger ones are trained on a sample so only one batch is held at a time
+            all_embeddings = train_embeddings = None
+            if len(nodes) <= self.train_sample_size:
+                all_embeddings = self._embed_nodes(nodes)
+                train_embeddings = all_embeddings
+            elif not faiss_index.is_trained:
+                sample_ids = np.random.default_rng(0).choice(
+                    len(nodes), self.train_sample_size, replace=False
+                )
+                train_embeddings = self._embed_nodes([nodes[i] for i in np.sort(sample_ids)])
 
             if not faiss_index.is_trained:
-                logging.info('Training FAISS index (IndexIVFFlat) on %d vectors', len(embeddings))
-                faiss_index.train(embeddings)
+                logging.info('Training FAISS index on %d vectors', len(train_embeddings))
+                faiss_index.train(train_embeddings)
                 logging.info('FAISS index training complete')
             else:
                 logging.info('FAISS index already trained')
+            del train_embeddings
 
             vector_store = FaissVectorStore(faiss_index=faiss_index)
             storage_context = StorageContext.from_defaults(vector_store=vector_store)
             logging.info('Created vector database')
 
             index = VectorStoreIndex(
-                nodes=nodes,
+                nodes=[],
                 storage_context=storage_context,
                 embed_model=self.embed_model,
-                show_progress=True
+                insert_batch_size=self.insert_batch_size
             )
+            for start in range(0, len(nodes), self.insert_batch_size):
+                batch = nodes[start:start + self.insert_batch_size]
+                if all_embeddings is not None:
+                    embeddings = all_embeddings[start:start + len(batch)]
+                else:
+                    embeddings = self._embed_nodes(batch)
+
+                # Nodes that already carry an embedding are not embedded again by the index
+                for node, embedding in zip(batch, embeddings):
+                    node.embedding = embedding.tolist()
+                index.insert_nodes(batch)
+                # The store keeps its own copy; the caller's nodes don't need to hold one
+                for node in batch:
+                    node.embedding = None
+
+                logging.info('Indexed %d/%d chunks', start + len(batch), len(nodes))
+
             logging.info('Index creation complete')
             index.storage_context.persist(persist_dir=str(self.vector_store_path))
             faiss.write_index(faiss_index, str(self.vector_store_path / 'faiss.index'))
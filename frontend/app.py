@@ -1,22 +1,77 @@
+import asyncio
 import json
+import queue
 import re
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
 import sys
 import streamlit as st
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 from rag.ask_llm import CarAssistant
+from rag.llm_connector import LLMConnector
+from rag.query_cache import ProximityCache
 from rag.search import *
 
 CREDENTIALS_PATH = project_root / 'assets' / 'secrets' / 'credentials.json'
 LOGS_PATH = project_root / 'rag' / 'interaction_logs.jsonl'
 
+# Prompts are kept free of source indentation, which would otherwise be sent as tokens
+REPHRASE_PROMPT = (
+    'You are a query rewriting expert. Your task is to rephrase the "Follow-up Question" '
+    'to be a standalone question that incorporates necessary context from the '
+    '"Chat History". If the "Follow-up Question" is already standalone or the history '
+    'does not seem relevant to it, return the original "Follow-up Question" unchanged.\n'
+    'Only output the rephrased standalone question, without any preamble or explanation.\n'
+    '\n'
+    'Chat History:\n'
+    '{chat_history}\n'
+    '\n'
+    'Follow-up Question: {question}\n'
+    '\n'
+    'Standalone Question:'
+)
+
+SEARCH_STATEMENT_PROMPT = (
+    'Your task is to convert user questions into concise statements or descriptive '
+    'phrases suitable for semantic search in a vector database. Focus on the core topic, '
+    'removing conversational filler and question structure.\n'
+    '---\n'
+    'User Question: "Hey, can you tell me what the main benefits of using '
+    'Retrieval-Augmented Generation are?"\n'
+    'Optimized Search Statement: "Benefits of Retrieval-Augmented Generation (RAG)"\n'
+    '---\n'
+    'User Question: "I\'m trying to understand how photosynthesis works in plants."\n'
+    'Optimized Search Statement: "Process of photosynthesis in plants"\n'
+    '---\n'
+    'User Question: "What\'s the difference between the iPhone 15 Pro and the Samsung S24 '
+    'Ultra cameras?"\n'
+    'Optimized Search Statement: "Comparison of iPhone 15 Pro and Samsung S24 Ultra cameras"\n'
+    '---\n'
+    'User Question: "How do I reset my forgotten password for my online banking account?"\n'
+    'Optimized Search Statement: "Resetting forgotten online banking password"\n'
+    '---\n'
+    'User Question: "Could you explain the historical context surrounding the fall of the '
+    'Berlin Wall?"\n'
+    'Optimized Search Statement: "Historical context of the fall of the Berlin Wall"\n'
+    '---\n'
+    'User Question: "{question}"\n'
+    'Optimized Search Statement:'
+)
+
 def log_interaction(query, answer, chunks, prompt):
     '''
-    Logs the interaction with query, answer, context, chunks and the prompt used
+    Logs the interaction with query, answer, context, chunks and the prompt used.
+    The entry is written by a background thread, off the request path
     '''
     log_entry = {
         'question': query,
@@ -25,8 +80,44 @@ def log_interaction(query, answer, chunks, prompt):
         'prompt': prompt,
         'timestamp': datetime.now().isoformat()
     }
-    with open(LOGS_PATH, 'a', encoding='utf-8') as f:
-        f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
+    get_log_queue().put(log_entry)
+
+def _log_worker(log_queue: queue.Queue, max_batch: int = 32, max_wait: float = 0.1):
+    '''
+    Appends queued log entries to the log file, flushing once per batch of up to
+    max_batch entries or after max_wait seconds
+    '''
+    with open(LOGS_PATH, 'ab') as f:
+        while True:
+            entries = [log_queue.get()]
+            deadline = time.monotonic() + max_wait
+            while len(entries) < max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entries.append(log_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            f.write(b''.join(_dump_log_entry(entry) for entry in entries))
+            f.flush()
+
+def _dump_log_entry(log_entry: dict) -> bytes:
+    '''
+    Serializes a log entry as one UTF-8 JSON line
+    '''
+    if orjson is not None:
+        return orjson.dumps(log_entry, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS)
+    return (json.dumps(log_entry, ensure_ascii=False) + '\n').encode('utf-8')
+
+@st.cache_resource
+def get_log_queue() -> queue.Queue:
+    '''Starts the log writer thread once per server process and returns its queue.
+    '''
+    log_queue = queue.Queue()
+    threading.Thread(target=_log_worker, args=(log_queue,), daemon=True).start()
+    return log_queue
 
 @st.cache_resource
 def initialize_resources():
@@ -34,18 +125,44 @@ def initialize_resources():
     '''
     model = initialize_embed_model(
         model_name='BAAI/bge-base-en-v1.5',
-        device=None,
+        device=EMBED_DEVICE,
         model_kwargs={}
     )
     vector_index = load_vector_index(model)
-    return model, vector_index
+    llm = LLMConnector(str(CREDENTIALS_PATH))
+    answer_cache = None
+    if model is not None:
+        answer_cache = ProximityCache(len(model.get_query_embedding('test')))
+    return model, vector_index, llm, answer_cache
+
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def cached_llm_answer(_llm: LLMConnector, prompt: str) -> str:
+    '''Answers a prompt with the LLM. Streamlit keys the cache on a hash of the prompt,
+    so repeated rewrite prompts, also across sessions, skip the LLM round-trip.
+    '''
+    return _llm.generate_answer(prompt)
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def cached_query_embedding(_embed_model, query: str) -> list:
+    '''Embeds a search statement once per distinct phrasing.
+    '''
+    return _embed_model.get_query_embedding(query)
+
+def rewrite_standalone_query(llm: LLMConnector, chat_history_str: str,
+                             current_query: str) -> str:
+    '''Rephrases a follow-up question into a standalone one.
+    '''
+    rephrase_prompt = REPHRASE_PROMPT.format(chat_history=chat_history_str,
+                                             question=current_query)
+    return cached_llm_answer(llm, rephrase_prompt).strip()
 
 
 class RAGCarChatbotApp:
     def __init__(self):
         self._setup_page()
-        self.embed_model, self.index = initialize_resources()
-        self.assistant = CarAssistant(query='', nodes=None, credentials_path=str(CREDENTIALS_PATH))
+        # Shared by all sessions; per-request state lives in a CarAssistant built in run()
+        self.embed_model, self.index, self.llm, self.answer_cache = initialize_resources()
         self._init_session_state()
 
     def _setup_page(self):
@@ -74,60 +191,34 @@ class RAGCarChatbotApp:
             return current_query
 
         chat_history_str = self._get_chat_history_for_prompt(last_n=3)
-
-        rephrase_prompt = f'''You are a query rewriting expert. Your task is to rephrase the
-        "Follow-up Question" to be a standalone question that incorporates necessary context 
-        from the "Chat History". If the "Follow-up Question" is already standalone or the 
-        history does not seem relevant to it, return the original "Follow-up Question" unchanged.
-        Only output the rephrased standalone question, without any preamble or explanation.
-
-                            Chat History:
-                            {chat_history_str}
-
-                            Follow-up Question: {current_query}
-
-                            Standalone Question:'''
-        standalone_query = self.assistant.llm.generate_answer(rephrase_prompt).strip()
+        standalone_query = rewrite_standalone_query(self.llm, chat_history_str,
+                                                    current_query)
         print(f'Original query: {current_query}\nStandalone query: {standalone_query}')
         return standalone_query
 
     def run(self):
         '''Defines prompt and query, fetches the results and chat history.'''
         query = st.chat_input('Ask something...')
-        standalone_query = self._get_standalone_query(query)
-
-        prompt = f'''
-            Your task is to convert user questions into concise statements or descriptive phrases suitable for semantic search in a vector database. Focus on the core topic, removing conversational filler and question structure.
-            ---
-            User Question: "Hey, can you tell me what the main benefits of using Retrieval-Augmented Generation are?"
-            Optimized Search Statement: "Benefits of Retrieval-Augmented Generation (RAG)"
-            ---
-            User Question: "I'm trying to understand how photosynthesis works in plants."
-            Optimized Search Statement: "Process of photosynthesis in plants"
-            ---
-            User Question: "What's the difference between the iPhone 15 Pro and the Samsung S24 Ultra cameras?"
-            Optimized Search Statement: "Comparison of iPhone 15 Pro and Samsung S24 Ultra cameras"
-            ---
-            User Question: "How do I reset my forgotten password for my online banking account?"
-            Optimized Search Statement: "Resetting forgotten online banking password"
-            ---
-            User Question: "Could you explain the historical context surrounding the fall of the Berlin Wall?"
-            Optimized Search Statement: "Historical context of the fall of the Berlin Wall"
-            ---
-            User Question: "{standalone_query}"
-            Optimized Search Statement:
-        '''
-        query_to_statement = self.assistant.llm.generate_answer(prompt)
-
         if query:
+            standalone_query = self._get_standalone_query(query)
+
+            prompt = SEARCH_STATEMENT_PROMPT.format(question=standalone_query)
+            query_to_statement = cached_llm_answer(self.llm, prompt)
+
             st.session_state.chat_history.append({'role': 'user', 'content': query})
 
-            results = search_in_index(query_str=query_to_statement, index=self.index)
+            query_embedding = (cached_query_embedding(self.embed_model, query_to_statement)
+                               if self.embed_model else None)
+            assistant = CarAssistant(query=standalone_query, nodes=None,
+                                     credentials_path=str(CREDENTIALS_PATH),
+                                     embed_model=self.embed_model,
+                                     llm=self.llm, cache=self.answer_cache)
+            result = asyncio.run(assistant.aget_answer_pipelined(
+                self.index, query_to_statement, query_embedding, rerank=True
+            )) if self.index else None
 
-            if results:
-                self.assistant.set_query(standalone_query)
-                self.assistant.set_nodes(new_nodes=results)
-                answer, retrieved_chunks = self.assistant.get_answer()
+            if result is not None:
+                answer, retrieved_chunks = result
 
                 fallback_responses = [
                     'Based on the provided context, I am unable to provide an answer.',
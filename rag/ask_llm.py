@@ -1,17 +1,62 @@
 '''Module for prompting the llm.'''
+import asyncio
 import logging
-from typing import List, Tuple
+from typing import Iterator, List, Optional, Tuple
+from llama_index.core import VectorStoreIndex
+from llama_index.core.base.embeddings.base import BaseEmbedding
 from llama_index.core.schema import NodeWithScore
+from data_processing.text_chunker import mentioned_model
 from rag.llm_connector import LLMConnector
+from rag.query_cache import ProximityCache
+from rag.search import SIMILARITY_TOP_K, search_in_index, speculative_search_in_index
+
+# Sent as the system message of every answer request. Keeping the instructions in a
+# constant prefix, ahead of the per-query context, lets the provider reuse it from
+# its prompt cache instead of prefilling it again
+SYSTEM_PROMPT = (
+    'You are a helpful AI assistant specializing in answering questions about cars.\n'
+    'Your primary goal is to answer the user\'s question using ONLY the information '
+    'provided in the "Context" section.\n'
+    '\n'
+    'IMPORTANT: The "Context" may contain textual descriptions of one or more images. '
+    'You should treat these descriptions as factual information about the visual aspects '
+    'of the car(s) or relevant scenes. For example, if an image description states '
+    '"a red sports car with a black interior," you can use this to answer questions about '
+    'the car\'s color or interior.\n'
+    '\n'
+    'Carefully and thoroughly review the ENTIRE provided context before answering.\n'
+    '\n'
+    'If the information required to answer the question is explicitly present or can be '
+    'directly inferred from the provided context (including any image descriptions), '
+    'please provide a concise answer.\n'
+    '\n'
+    'Do not use any external knowledge or make assumptions beyond what is explicitly '
+    'stated in the context.'
+)
 
 class CarAssistant:
     '''Class for defining the prompt to the llm.'''
     def __init__(self, query: str, nodes: List[NodeWithScore],
-                 credentials_path: str = 'credentials.json') -> None:
+                 credentials_path: str = 'credentials.json',
+                 embed_model: Optional[BaseEmbedding] = None,
+                 cache_threshold: float = 0.95, cache_capacity: int = 1024,
+                 llm: Optional[LLMConnector] = None,
+                 cache: Optional[ProximityCache] = None) -> None:
+        '''With an embed_model, answers are cached and reused for queries whose
+        embedding has cosine similarity >= cache_threshold with a previous one.
+        Cached answers are also keyed by the car model named in the query, so questions
+        that differ only in the model never share an answer.
+        An llm connector and answer cache can be passed in to share them between
+        assistants; the assistant itself holds per-request state and is not shared.'''
         self.query = query
         self.nodes = nodes
         self.credentials_path = credentials_path
-        self.llm = LLMConnector(credentials_path)
+        self.llm = llm if llm is not None else LLMConnector(credentials_path)
+        self.embed_model = embed_model
+        self.cache: Optional[ProximityCache] = cache
+        if cache is None and embed_model is not None:
+            dim = len(embed_model.get_query_embedding('test'))
+            self.cache = ProximityCache(dim, threshold=cache_threshold, capacity=cache_capacity)
 
     def set_nodes(self, new_nodes: List[NodeWithScore]):
         '''Updates the nodes.'''
@@ -23,53 +68,163 @@ class CarAssistant:
         logging.info('Query updated')
         self.query = new_query
 
-    def _build_prompt(self) -> str:
-        if not self.nodes:
-            logging.warning('No context provided to build prompt.')
-            return ''
-        context = '\n\n'.join([
-            node.node.get_content()
-            for node in self.nodes
-            if node.node.get_content()
-        ])
-
-        prompt = f'''You are a helpful AI assistant specializing in answering questions about cars.
-                    Your primary goal is to answer the user's question using ONLY the information provided in the "Context" section.
+    @staticmethod
+    def _node_contents(nodes: Optional[List[NodeWithScore]]) -> List[str]:
+        '''Returns the non-empty contents of the nodes, calling get_content() once per node.'''
+        return [content for content in (node.node.get_content() for node in nodes or [])
+                if content]
 
-                    IMPORTANT: The "Context" may contain textual descriptions of one or more images. You should treat these descriptions as factual information about the visual aspects of the car(s) or relevant scenes. For example, if an image description states "a red sports car with a black interior," you can use this to answer questions about the car's color or interior.
+    @staticmethod
+    def _retrieved_chunks(contents: List[str]) -> str:
+        return '\n\n---\n\n'.join(contents)
 
-                    Carefully and thoroughly review the ENTIRE provided context before answering.
-
-                    If the information required to answer the question is explicitly present or can be directly inferred from the provided context (including any image descriptions), please provide a concise answer.
-
-                    Do not use any external knowledge or make assumptions beyond what is explicitly stated in the context.
+    def _build_prompt(self, contents: List[str], query: Optional[str] = None) -> str:
+        query = self.query if query is None else query
+        if not contents:
+            logging.warning('No context provided to build prompt.')
+            return ''
+        context = '\n\n'.join(contents)
 
-                    Context:
-                    {context}
+        prompt = f'''Context:
+{context}
 
-                    Question:
-                    {self.query}
+Question:
+{query}
 
-                    Answer:
-                    '''
+Answer:'''
         return prompt
 
     def get_answer(self) -> Tuple[str, str]:
         '''Returns the answer. If no prompt is given it returns a defined answer.'''
-        prompt = self._build_prompt()
+        contents = self._node_contents(self.nodes)
+        prompt = self._build_prompt(contents)
 
         if not prompt:
             return 'Could not generate a prompt from the provided context.', ''
 
         try:
-            answer = self.llm.generate_answer(prompt)
-            retrieved_chunks = '\n\n---\n\n'.join([
-                node.node.get_content()
-                for node in self.nodes
-                if node.node.get_content()
-            ])
+            query_embedding = None
+            cache_key = mentioned_model(self.query)
+            if self.cache is not None:
+                query_embedding = self.embed_model.get_query_embedding(self.query)
+                cached = self.cache.get(query_embedding, cache_key)
+                if cached is not None:
+                    logging.info('Answer served from the query cache')
+                    return cached
+
+            answer = self.llm.generate_answer(prompt, system_prompt=SYSTEM_PROMPT)
+            retrieved_chunks = self._retrieved_chunks(contents)
+            if query_embedding is not None:
+                self.cache.put(query_embedding, (answer, retrieved_chunks), cache_key)
+            return answer, retrieved_chunks
+        except Exception as e:
+            logging.error('Failed to get LLM response: %s', e, exc_info=True)
+            return 'An error occurred while contacting the LLM.', ''
+
+    def get_answer_stream(self) -> Tuple[Iterator[str], str]:
+        '''Like get_answer, but returns the answer as an iterator over its pieces,
+        so the first tokens can be shown before the llm has finished.'''
+        contents = self._node_contents(self.nodes)
+        prompt = self._build_prompt(contents)
+
+        if not prompt:
+            return iter(['Could not generate a prompt from the provided context.']), ''
+
+        query_embedding = None
+        cache_key = mentioned_model(self.query)
+        if self.cache is not None:
+            query_embedding = self.embed_model.get_query_embedding(self.query)
+            cached = self.cache.get(query_embedding, cache_key)
+            if cached is not None:
+                logging.info('Answer served from the query cache')
+                return iter([cached[0]]), cached[1]
+
+        retrieved_chunks = self._retrieved_chunks(contents)
+
+        def pieces() -> Iterator[str]:
+            parts = []
+            try:
+                for piece in self.llm.stream_answer(prompt, system_prompt=SYSTEM_PROMPT):
+                    parts.append(piece)
+                    yield piece
+            except Exception as e:
+                logging.error('Failed to get LLM response: %s', e, exc_info=True)
+                yield 'An error occurred while contacting the LLM.'
+                return
+            if query_embedding is not None:
+                self.cache.put(query_embedding, (''.join(parts), retrieved_chunks), cache_key)
+
+        return pieces(), retrieved_chunks
+
+    async def aget_answer_pipelined(self, index: VectorStoreIndex, search_query: str,
+                                    search_embedding: Optional[List[float]],
+                                    top_k: int = SIMILARITY_TOP_K,
+                                    rerank: bool = False) -> Optional[Tuple[str, str]]:
+        '''
+        Retrieves the nodes for search_query and answers the current query, overlapping
+        the two. A cheap low-recall search supplies a speculative context and the LLM
+        starts on it while the full search runs. The speculative answer is kept when the
+        full search returns the same nodes in the same order; otherwise it is cancelled
+        and the answer is generated again from the final nodes. A confirmed speculative
+        request that fails is also retried once with the final nodes.
+        With rerank, the full search re-scores its candidates (see search_in_index).
+        Returns None when the search finds nothing.
+        The query and nodes are kept in locals; the instance is not modified.
+        '''
+        query = self.query
+        query_embedding = None
+        cache_key = mentioned_model(query)
+        if self.cache is not None:
+            query_embedding = await asyncio.to_thread(self.embed_model.get_query_embedding,
+                                                      query)
+            cached = self.cache.get(query_embedding, cache_key)
+            if cached is not None:
+                logging.info('Answer served from the query cache')
+                return cached
+
+        search_task = asyncio.create_task(asyncio.to_thread(
+            search_in_index, search_query, index, top_k, search_embedding, rerank
+        ))
+        speculative_nodes = await asyncio.to_thread(
+            speculative_search_in_index, search_embedding, index, top_k
+        )
+        speculative_task = None
+        if speculative_nodes:
+            speculative_task = asyncio.create_task(self.llm.agenerate_answer(
+                self._build_prompt(self._node_contents(speculative_nodes), query),
+                system_prompt=SYSTEM_PROMPT
+            ))
+
+        try:
+            nodes = await search_task
+            if not nodes:
+                return None
+            contents = self._node_contents(nodes)
+
+            answer = None
+            final_ids = [node.node.node_id for node in nodes]
+            if speculative_task is not None and \
+                    [node.node.node_id for node in speculative_nodes] == final_ids:
+                logging.info('Speculative context confirmed')
+                try:
+                    answer = await speculative_task
+                except Exception as e:  # pylint: disable=broad-except
+                    # The context is right, so a plain retry with it will likely succeed
+                    logging.warning('Speculative answer failed, generating again: %s', e)
+            elif speculative_task is not None:
+                logging.info('Speculative context rejected, generating again')
+                speculative_task.cancel()
+
+            if answer is None:
+                answer = await self.llm.agenerate_answer(self._build_prompt(contents, query),
+                                                         system_prompt=SYSTEM_PROMPT)
+
+            retrieved_chunks = self._retrieved_chunks(contents)
+            if query_embedding is not None:
+                self.cache.put(query_embedding, (answer, retrieved_chunks), cache_key)
             return answer, retrieved_chunks
         except Exception as e:
+            if speculative_task is not None:
+                speculative_task.cancel()
             logging.error('Failed to get LLM response: %s', e, exc_info=True)
             return 'An error occurred while contacting the LLM.', ''
-        
\ No newline at end of file
@@ -6,6 +6,13 @@ from pathlib import Path
 import numpy as np
 import search
 
+try:
+    from numba import njit, prange
+except ImportError:
+    # Without numba the loop kernel is plain Python and only the NumPy version is used
+    from builtins import range as prange
+    njit = None
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 project_root = Path(__file__).parent.parent
@@ -30,8 +37,9 @@ def read_questions(filepath: Path) -> list[str]:
         logging.error('Questions file not found: %s', filepath)
         return []
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            questions = [line.strip() for line in f if line.strip()]
+        # One read and a C-level split instead of a Python loop over file lines
+        lines = filepath.read_text(encoding='utf-8').splitlines()
+        questions = [question for line in lines if (question := line.strip())]
         logging.info('Read %d questions from %s', len(questions), filepath)
         return questions
     except Exception as e:
@@ -44,23 +52,79 @@ def find_largest_score_drop_index(scores: list[float]) -> int | None:
     of the largest drop.
     '''
 
-    scores_arr = np.array(scores)
-    differences = scores_arr[:-1] - scores_arr[1:]
+    # Drop from each score to the next, in one pass
+    differences = -np.diff(np.asarray(scores, dtype='float64'))
 
     if len(differences) == 0:
         logging.warning('No differences could be calculated')
         return None
 
-    max_diff_index = np.argmax(differences)
+    max_diff_index = differences.argmax()
 
-    logging.debug('Scores: %s', scores)
-    logging.debug('Differences: %s', differences.tolist())
-    logging.debug('Max difference index: %d, Value: %.4f', max_diff_index,
-                   differences[max_diff_index])
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug('Scores: %s', scores)
+        logging.debug('Differences: %s', differences.tolist())
+        logging.debug('Max difference index: %d, Value: %.4f', max_diff_index,
+                       differences[max_diff_index])
 
     return int(max_diff_index)
 
 
+def _drop_indices_loop(scores: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    '''
+    Per row of scores, the index of the largest drop between consecutive scores
+    among the first lengths[row] entries, or -1 for rows with fewer than 2 scores
+    '''
+    row_drops = np.empty(scores.shape[0], dtype=np.int64)
+    for row in prange(scores.shape[0]):
+        best_index = -1
+        best_drop = -np.inf
+        for i in range(lengths[row] - 1):
+            drop = scores[row, i] - scores[row, i + 1]
+            if drop > best_drop:
+                best_drop = drop
+                best_index = i
+        row_drops[row] = best_index
+    return row_drops
+
+def _drop_indices_numpy(scores: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    '''
+    NumPy version of _drop_indices_loop, used when numba is not installed
+    '''
+    with np.errstate(invalid='ignore'):  # -inf padding minus -inf padding
+        differences = -np.diff(scores, axis=1)
+    differences[np.arange(scores.shape[1] - 1) >= (lengths - 1)[:, None]] = -np.inf
+    row_drops = differences.argmax(axis=1)
+    row_drops[lengths < 2] = -1
+    return row_drops
+
+if njit is not None:
+    drop_indices = njit(cache=True, parallel=True)(_drop_indices_loop)
+else:
+    drop_indices = _drop_indices_numpy
+
+
+def question_scores(question: str, results: list, position: str) -> list[float] | None:
+    '''
+    Returns the scores of the question's results above SIMILARITY_THRESHOLD,
+    or None when there are too few to find a drop
+    '''
+    logging.info('\n--- Processing Question %s: \'%s\' ---', position, question)
+
+    if not results:
+        logging.warning('No results found for question: \'%s\'', question)
+        return None
+
+    scores = [node.score for node in results if node.score >= SIMILARITY_THRESHOLD]
+    logging.info('Retrieved %d results', len(scores))
+
+    if len(scores) < 2:
+        logging.warning('Retrieved less than 2 results (%d), cannot calculate drop point',
+                         len(scores))
+        return None
+    return scores
+
+
 def main():
     '''Executes the analysis to determine the optimal value of `top_k`.
        Outputs and logs suggested values.'''
@@ -87,49 +151,30 @@ def main():
         logging.error('Failed to load vector index. Exiting')
         sys.exit(1)
 
-    optimal_k_values = []
+    # One batched pass through the model instead of one forward pass per question
+    logging.info('Embedding %d questions...', len(questions))
+    question_embeddings = search.embed_queries(embed_model, questions)
 
-    for i, question in enumerate(questions):
-        logging.info('\n--- Processing Question %d/%d: \'%s\' ---', i + 1, len(questions), question)
-
-        results = search.search_in_index(
-            query_str=question,
-            index=index,
-            top_k=TOP_K_TO_ANALYZE
-        )
-
-        if not results:
-            logging.warning('No results found for question: \'%s\'', question)
-            continue
-
-        results = [node for node in results if node.score >= SIMILARITY_THRESHOLD]
-        scores = [node.score for node in results]
-        logging.info('Retrieved %d results', len(scores))
-
-        if len(scores) < 2:
-            logging.warning('Retrieved less than 2 results (%d), cannot calculate drop point',
-                             len(scores))
-            continue
-
-        drop_index = find_largest_score_drop_index(scores)
-
-        if drop_index is not None:
-            suggested_k = drop_index + 1
-            optimal_k_values.append(suggested_k)
-            logging.info('Largest score drop found after index %d. Suggested k = %d',
-                          drop_index, suggested_k)
-
-            if drop_index > 0:
-                logging.debug('  Score before drop (index %d): %.4f',
-                               drop_index - 1, scores[drop_index - 1])
-            logging.debug('  Score at drop start (index %d): %.4f', drop_index, scores[drop_index])
-            if drop_index + 1 < len(scores):
-                logging.debug('  Score after drop (index %d): %.4f',
-                               drop_index + 1, scores[drop_index + 1])
-            logging.debug('  Difference: %.4f', scores[drop_index] - scores[drop_index + 1])
-
-        else:
-            logging.warning('Could not determine a drop index for question: \'%s\'', question)
+    # One FAISS search over the whole (questions, dim) matrix
+    all_results = search.batch_search(np.asarray(question_embeddings), index, TOP_K_TO_ANALYZE)
+    all_scores = [
+        question_scores(question, results, f'{i + 1}/{len(questions)}')
+        for i, (question, results) in enumerate(zip(questions, all_results))
+    ]
+    all_scores = [scores for scores in all_scores if scores is not None]
+
+    # All drop points in one pass over a padded (questions, TOP_K_TO_ANALYZE) matrix
+    optimal_k_values = []
+    if all_scores:
+        lengths = np.array([len(scores) for scores in all_scores], dtype=np.int64)
+        score_matrix = np.full((len(all_scores), TOP_K_TO_ANALYZE), -np.inf)
+        for row, scores in enumerate(all_scores):
+            score_matrix[row, :len(scores)] = scores
+
+        optimal_k_values = [int(drop_index) + 1
+                            for drop_index in drop_indices(score_matrix, lengths)
+                            if drop_index >= 0]
+        logging.info('Suggested k per question: %s', optimal_k_values)
 
     if not optimal_k_values:
         logging.error('Could not determine optimal k for any question')
@@ -1,29 +1,50 @@
 '''Module for connecting to the llm.'''
-import json
+import os
+from functools import lru_cache
+from typing import Iterator, Optional
+from langchain_core.messages import HumanMessage, SystemMessage
 from gen_ai_hub.proxy.langchain.openai import ChatOpenAI
-from gen_ai_hub.proxy.core.proxy_clients import get_proxy_client
+from data_processing.hub_config import HubConfig, get_hub_proxy_client
+
+
+@lru_cache(maxsize=4)
+def _load_hub_config(credentials_path: str, _mtime_ns: int) -> HubConfig:
+    '''Parses the credentials file once per path and modification time.'''
+    return HubConfig.from_credentials(credentials_path)
+
+@lru_cache(maxsize=8)
+def _chat_llm(config: HubConfig, model_name: str, temperature: float) -> ChatOpenAI:
+    '''One chat model per config and settings, shared by all connectors.'''
+    return ChatOpenAI(
+        proxy_client=get_hub_proxy_client(config),
+        proxy_model_name=model_name,
+        temperature=temperature
+    )
 
 class LLMConnector:
     '''Uses credentials to connect to the llm.'''
     def __init__(self, credentials_path: str, model_name: str = 'gpt-4o', temperature: float = 0.0):
-        with open(credentials_path, 'r') as f:
-            creds = json.load(f)
-
-        self.proxy_client = get_proxy_client(
-            proxy_version='gen-ai-hub',
-            base_url=creds['serviceurls']['AI_API_URL'],
-            auth_url=creds['url'],
-            client_id=creds['clientid'],
-            client_secret=creds['clientsecret']
-        )
-
-        self.llm = ChatOpenAI(
-            proxy_client=self.proxy_client,
-            proxy_model_name=model_name,
-            temperature=temperature
-        )
-
-    def generate_answer(self, prompt: str) -> str:
-        '''Invoking the llm.'''
-        return self.llm.invoke(prompt).content
-    
\ No newline at end of file
+        config = _load_hub_config(str(credentials_path), os.stat(credentials_path).st_mtime_ns)
+
+        self.proxy_client = get_hub_proxy_client(config)
+        self.llm = _chat_llm(config, model_name, temperature)
+
+    @staticmethod
+    def _messages(prompt: str, system_prompt: Optional[str]):
+        if system_prompt is None:
+            return prompt
+        return [SystemMessage(content=system_prompt), HumanMessage(content=prompt)]
+
+    def generate_answer(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+        '''Invoking the llm. A system_prompt is sent as a separate system message.'''
+        return self.llm.invoke(self._messages(prompt, system_prompt)).content
+
+    def stream_answer(self, prompt: str, system_prompt: Optional[str] = None) -> Iterator[str]:
+        '''Yields the answer in pieces as the llm produces them.'''
+        for chunk in self.llm.stream(self._messages(prompt, system_prompt)):
+            if chunk.content:
+                yield chunk.content
+
+    async def agenerate_answer(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+        '''Async version of generate_answer. Cancelling the task aborts the request.'''
+        return (await self.llm.ainvoke(self._messages(prompt, system_prompt))).content
@@ -0,0 +1,85 @@
+'''Approximate cache of answers keyed by query embeddings.'''
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+
+
+class ProximityCache:
+    '''
+    LRU cache that returns the value stored for a previous query whose embedding has
+    cosine similarity >= threshold with the new one.
+    Embeddings are bucketed by random-hyperplane LSH; a lookup scans the query's bucket
+    and the buckets one hyperplane flip away, so near-duplicates on either side of a
+    single hyperplane are still found.
+    An optional key, such as the car model named in the query, partitions the cache:
+    queries with different keys never share an answer, however close their embeddings.
+    '''
+
+    def __init__(self, dim: int, threshold: float = 0.95, capacity: int = 1024,
+                 n_planes: int = 8, seed: int = 0):
+        self.threshold = threshold
+        self.capacity = capacity
+        rng = np.random.default_rng(seed)
+        self._planes = rng.standard_normal((n_planes, dim)).astype('float32')
+        self._bit_flips = [0] + [1 << bit for bit in range(n_planes)]
+        # (key, bucket) -> [(entry id, unit embedding, value)]
+        self._buckets: dict = {}
+        # entry id -> (key, bucket), oldest first
+        self._lru: OrderedDict = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    @staticmethod
+    def _unit(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype='float32')
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _bucket(self, vector: np.ndarray) -> int:
+        bits = (self._planes @ vector) > 0
+        return int(np.dot(bits, 1 << np.arange(len(bits))))
+
+    def get(self, embedding: Sequence[float], key: Optional[str] = None) -> Optional[Any]:
+        '''Returns the value of the most similar cached query above the threshold
+        stored under the same key, or None.'''
+        vector = self._unit(embedding)
+        bucket = self._bucket(vector)
+
+        with self._lock:
+            best_similarity = self.threshold
+            best_entry = None
+            for flip in self._bit_flips:
+                for entry in self._buckets.get((key, bucket ^ flip), ()):
+                    similarity = float(entry[1] @ vector)
+                    if similarity >= best_similarity:
+                        best_similarity = similarity
+                        best_entry = entry
+
+            if best_entry is None:
+                return None
+            self._lru.move_to_end(best_entry[0])
+            return best_entry[2]
+
+    def put(self, embedding: Sequence[float], value: Any, key: Optional[str] = None):
+        '''Caches the value for the query under key, evicting the least recently
+        used entries.'''
+        vector = self._unit(embedding)
+        bucket = (key, self._bucket(vector))
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._buckets.setdefault(bucket, []).append((entry_id, vector, value))
+            self._lru[entry_id] = bucket
+
+            while len(self._lru) > self.capacity:
+                old_id, old_bucket = self._lru.popitem(last=False)
+                entries: List = self._buckets[old_bucket]
+                entries[:] = [entry for entry in entries if entry[0] != old_id]
+                if not entries:
+                    del self._buckets[old_bucket]
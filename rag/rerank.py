@@ -0,0 +1,42 @@
+'''Exact cosine re-scoring of retrieved candidates.'''
+from typing import Tuple
+
+import numpy as np
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+
+def cosine_similarities(query_vec: np.ndarray, node_vecs: np.ndarray) -> np.ndarray:
+    '''
+    Cosine similarity of the query with each row of node_vecs.
+    Uses SimSIMD's SIMD kernels when installed, NumPy otherwise
+    '''
+    query_vec = np.ascontiguousarray(query_vec, dtype='float32').reshape(1, -1)
+    node_vecs = np.ascontiguousarray(node_vecs, dtype='float32')
+
+    if simsimd is not None:
+        distances = np.asarray(simsimd.cdist(query_vec, node_vecs, metric='cosine'))
+        return 1.0 - distances.reshape(-1)
+
+    norms = np.linalg.norm(node_vecs, axis=1) * np.linalg.norm(query_vec)
+    norms[norms == 0] = 1.0
+    return (node_vecs @ query_vec[0]) / norms
+
+
+def rerank(query_vec: np.ndarray, node_vecs: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns the row indices of the k rows of node_vecs most similar to the query,
+    best first, and their cosine similarities
+    '''
+    similarities = cosine_similarities(query_vec, node_vecs)
+    k = min(k, len(similarities))
+    if k <= 0:
+        return np.empty(0, dtype='int64'), np.empty(0, dtype='float32')
+
+    # Partial selection of the k best, then a sort of only those k
+    top = np.argpartition(-similarities, k - 1)[:k]
+    top = top[np.argsort(-similarities[top])]
+    return top, similarities[top]
@@ -1,13 +1,27 @@
 '''Search module for querying the vector index built from processed document chunks.'''
+import os
 import sys
 import logging
+import threading
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from llama_index.core.schema import NodeWithScore
+import faiss
+import numpy as np
+from llama_index.core.schema import NodeWithScore, QueryBundle
 from llama_index.core import VectorStoreIndex
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.embeddings.base import BaseEmbedding
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from data_processing import vectorizer
+from data_processing.onnx_embedding import (DEFAULT_ONNX_MODEL_DIR, OnnxEmbedding,
+                                            export_onnx_model)
+from rag.rerank import rerank as rerank_by_cosine
+
+try:
+    from llama_index.embeddings.text_embeddings_inference import TextEmbeddingsInference
+except ImportError:
+    TextEmbeddingsInference = None
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -19,32 +33,70 @@ VECTOR_STORE_DIR = project_root / 'assets' / 'vector_store'
 EMBEDDING_MODEL_NAME = 'BAAI/bge-base-en-v1.5'
 EMBEDDING_DIM = 768
 EMBED_MODEL_KWARGS = {}
-EMBED_DEVICE = None
+EMBED_DEVICE = vectorizer.default_embed_device()
+
+EMBED_BATCH_SIZE = 64
+
+# 'torch' runs the HuggingFace model in-process, 'onnx' an optimized int8 ONNX Runtime
+# export (created in ONNX_MODEL_DIR on first use), 'tei' a Text Embeddings Inference server
+EMBED_BACKEND = os.environ.get('EMBED_BACKEND', 'torch')
+ONNX_MODEL_DIR = DEFAULT_ONNX_MODEL_DIR
+TEI_URL = os.environ.get('TEI_URL', 'http://localhost:8080')
 
 SIMILARITY_TOP_K = 5
-IVF_NPROBE = 16
+# Candidates fetched per returned node when re-ranking
+RERANK_CANDIDATE_FACTOR = 4
+IVF_NPROBE = 32
+# Lower bound of the HNSW candidate list is HNSW_EF_SEARCH_FACTOR * top_k
+HNSW_EF_SEARCH_FACTOR = 2
+
+# Search effort of the cheap pass that supplies the speculative LLM context
+SPECULATIVE_NPROBE = 4
+SPECULATIVE_EF_SEARCH = 16
 
 
 def initialize_embed_model(model_name: str,
-    device: Optional[str], model_kwargs: Optional[dict]) -> Optional[HuggingFaceEmbedding]:
+    device: Optional[str], model_kwargs: Optional[dict],
+    backend: str = EMBED_BACKEND) -> Optional[BaseEmbedding]:
     '''
-    Initializes the HuggingFace embedding model.
+    Initializes the embedding model on the selected backend.
+    Query embeddings are unit-normalized to match the inner-product index.
     '''
-    logging.info('Initializing HuggingFace embedding model: %s', model_name)
+    logging.info('Initializing %s embedding model: %s', backend, model_name)
     try:
-        model = HuggingFaceEmbedding(
-            model_name=model_name,
-            device=device,
-            model_kwargs=model_kwargs
-        )
+        if backend == 'onnx':
+            model = OnnxEmbedding(
+                model_path=str(export_onnx_model(model_name, ONNX_MODEL_DIR)),
+                tokenizer_name=model_name,
+                embed_batch_size=EMBED_BATCH_SIZE
+            )
+        elif backend == 'tei':
+            if TextEmbeddingsInference is None:
+                raise ImportError('The TEI backend needs '
+                                  '`llama-index-embeddings-text-embeddings-inference` installed')
+            model = TextEmbeddingsInference(
+                model_name=model_name,
+                base_url=TEI_URL,
+                embed_batch_size=EMBED_BATCH_SIZE
+            )
+        else:
+            model = HuggingFaceEmbedding(
+                model_name=model_name,
+                device=device,
+                model_kwargs=model_kwargs,
+                normalize=True,
+                embed_batch_size=EMBED_BATCH_SIZE
+            )
+            vectorizer.half_embed_model(model, device)
+            vectorizer.compile_embed_model(model, device)
         logging.info('Embedding model initialized successfully')
         return model
     except Exception as e:
-        logging.error('Failed to initialize HuggingFace Embedding model %r: %s',
-                       model_name, e, exc_info=True)
+        logging.error('Failed to initialize %s embedding model %r: %s',
+                       backend, model_name, e, exc_info=True)
         return None
 
-def load_vector_index(embed_model: HuggingFaceEmbedding) -> Optional[VectorStoreIndex]:
+def load_vector_index(embed_model: BaseEmbedding) -> Optional[VectorStoreIndex]:
     '''
     Loads the VectorStoreIndex from the specified storage path
     '''
@@ -58,7 +110,8 @@ def load_vector_index(embed_model: HuggingFaceEmbedding) -> Optional[VectorStore
             vector_store_path=VECTOR_STORE_DIR,
             embed_model_kwargs=EMBED_MODEL_KWARGS,
             embed_device=EMBED_DEVICE,
-            ivf_nprobe=IVF_NPROBE
+            ivf_nprobe=IVF_NPROBE,
+            embed_model=embed_model
         )
 
         index = vector_index.build_or_load_index(nodes=[])
@@ -69,10 +122,71 @@ def load_vector_index(embed_model: HuggingFaceEmbedding) -> Optional[VectorStore
         logging.error('Failed to load index: %s', e, exc_info=True)
         return None
 
+_retriever_lock = threading.Lock()
+
+def _get_retriever(index: VectorStoreIndex, top_k: int) -> BaseRetriever:
+    '''
+    Returns the retriever of the index for top_k, building it on first use only.
+    The retrievers are kept on the index itself, so they are freed together with it
+    '''
+    with _retriever_lock:
+        retrievers: Dict[int, BaseRetriever] = getattr(index, '_retrievers_by_top_k', None)
+        if retrievers is None:
+            retrievers = {}
+            setattr(index, '_retrievers_by_top_k', retrievers)
+        retriever = retrievers.get(top_k)
+        if retriever is None:
+            retriever = retrievers[top_k] = index.as_retriever(similarity_top_k=top_k)
+        return retriever
+
+def _search_params(faiss_index: Optional[faiss.Index],
+                   top_k: int) -> Optional[faiss.SearchParameters]:
+    '''
+    Per-query parameters that make the HNSW candidate list at least
+    HNSW_EF_SEARCH_FACTOR * top_k long, so large top_k keep their recall without
+    changing efSearch on the shared index. Returns None when the index defaults suffice
+    '''
+    base_index = faiss_index
+    if isinstance(faiss_index, faiss.IndexRefine):
+        base_index = faiss.downcast_index(faiss_index.base_index)
+    ef_search = HNSW_EF_SEARCH_FACTOR * top_k
+    if not isinstance(base_index, faiss.IndexHNSW) or base_index.hnsw.efSearch >= ef_search:
+        return None
+    # faiss wraps the constructors of its parameter classes to take keyword arguments
+    params = faiss.SearchParametersHNSW(efSearch=ef_search)  # pylint: disable=unexpected-keyword-arg
+    return _with_refine_params(faiss_index, base_index, params)
+
+def _with_refine_params(faiss_index: faiss.Index, base_index: faiss.Index,
+                        params: faiss.SearchParameters) -> faiss.SearchParameters:
+    '''
+    Wraps the parameters of the base index for a refine layer on top of it, if any
+    '''
+    if base_index is not faiss_index:
+        # The keyword constructor also keeps the base parameters alive
+        params = faiss.IndexRefineSearchParameters(  # pylint: disable=unexpected-keyword-arg
+            k_factor=faiss_index.k_factor, base_index_params=params
+        )
+    return params
+
+def _search_faiss(query_embedding: List[float], index: VectorStoreIndex, top_k: int,
+                  params: Optional[faiss.SearchParameters]) -> List[NodeWithScore]:
+    '''
+    Searches the FAISS index directly with per-query parameters, which the index
+    retriever cannot pass on
+    '''
+    query = np.asarray([query_embedding], dtype='float32')
+    scores, ids = _faiss_index_of(index).search(query, top_k, params=params)
+    return _nodes_for_hits(index, ids[0], scores[0])
+
 def search_in_index(query_str: str, index: VectorStoreIndex,
-                     top_k: int = SIMILARITY_TOP_K) -> List[NodeWithScore]:
+                     top_k: int = SIMILARITY_TOP_K,
+                     query_embedding: Optional[List[float]] = None,
+                     rerank: bool = False) -> List[NodeWithScore]:
     '''
-    Performs a similiarity search on the loaded vector index using its retriever
+    Performs a similiarity search on the loaded vector index using its retriever.
+    A precomputed query_embedding skips encoding the query again.
+    With rerank, more candidates are fetched and re-scored by cosine similarity with
+    their stored vectors; indexes that cannot reconstruct them return the plain search
     '''
     if not query_str:
         logging.warning('Empty query text')
@@ -83,17 +197,30 @@ def search_in_index(query_str: str, index: VectorStoreIndex,
     logging.info('Performing search for query: %r with top_k=%d', query_str, top_k)
 
     try:
-        retriever = index.as_retriever(similarity_top_k=top_k)
-        retriever_nodes = retriever.retrieve(query_str)
+        retriever_nodes = None
+        params = _search_params(_faiss_index_of(index), top_k)
+        if query_embedding is None and (rerank or params is not None):
+            query_embedding = index._embed_model.get_query_embedding(query_str)  # pylint: disable=protected-access
+        if rerank:
+            retriever_nodes = _reranked_search(query_embedding, index, top_k)
+
+        if retriever_nodes is None and params is not None:
+            retriever_nodes = _search_faiss(query_embedding, index, top_k, params)
+        if retriever_nodes is None:
+            retriever = _get_retriever(index, top_k)
+            retriever_nodes = retriever.retrieve(
+                QueryBundle(query_str=query_str, embedding=query_embedding)
+            )
 
         if not retriever_nodes:
             logging.info('No results')
             return []
         logging.info('Search successful. Retrieved %d nodes', len(retriever_nodes))
 
-        for i, node_with_score in enumerate(retriever_nodes):
-            logging.debug('  Result %d: Node ID: %s, Score: %.4f',
-                          i+1, node_with_score.node.node_id, node_with_score.score)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for i, node_with_score in enumerate(retriever_nodes):
+                logging.debug('  Result %d: Node ID: %s, Score: %.4f',
+                              i+1, node_with_score.node.node_id, node_with_score.score)
 
         return retriever_nodes
 
@@ -101,3 +228,143 @@ def search_in_index(query_str: str, index: VectorStoreIndex,
         logging.error('An error occurred during search for query %r: %s',
          query_str, e, exc_info=True)
         return []
+
+def embed_queries(embed_model: BaseEmbedding, queries: List[str]) -> List[List[float]]:
+    '''
+    Embeds many queries in batched forward passes of embed_batch_size, with the
+    same query prompt and normalization as get_query_embedding
+    '''
+    if not isinstance(embed_model, HuggingFaceEmbedding):
+        return [embed_model.get_query_embedding(query) for query in queries]
+
+    embeddings = embed_model._model.encode(  # pylint: disable=protected-access
+        queries,
+        batch_size=embed_model.embed_batch_size,
+        prompt_name='query',
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=True
+    )
+    return embeddings.tolist()
+
+def search_in_index_with_embedding(query_embedding: List[float], index: VectorStoreIndex,
+                                   top_k: int = SIMILARITY_TOP_K) -> List[NodeWithScore]:
+    '''
+    Performs a similarity search with a precomputed query embedding, without
+    running the embedding model
+    '''
+    if query_embedding is None:
+        logging.warning('Empty query embedding')
+        return []
+    if not index:
+        logging.error('Provided index object is invalid or None')
+        return []
+
+    try:
+        params = _search_params(_faiss_index_of(index), top_k)
+        if params is not None:
+            return _search_faiss(query_embedding, index, top_k, params)
+        retriever = _get_retriever(index, top_k)
+        return retriever.retrieve(QueryBundle(query_str='', embedding=query_embedding))
+    except Exception as e:
+        logging.error('An error occurred during search by embedding: %s', e, exc_info=True)
+        return []
+
+def _speculative_search_params(faiss_index: faiss.Index) -> Optional[faiss.SearchParameters]:
+    '''
+    Search parameters for a low-recall pass over the index: fewer probed lists for IVF,
+    a smaller candidate list for HNSW. Returns None for exact indexes
+    '''
+    base_index = faiss_index
+    if isinstance(faiss_index, faiss.IndexRefine):
+        base_index = faiss.downcast_index(faiss_index.base_index)
+
+    if isinstance(base_index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(efSearch=SPECULATIVE_EF_SEARCH)  # pylint: disable=unexpected-keyword-arg
+    else:
+        try:
+            faiss.extract_index_ivf(base_index)
+        except RuntimeError:
+            return None
+        params = faiss.SearchParametersIVF(nprobe=SPECULATIVE_NPROBE)  # pylint: disable=unexpected-keyword-arg
+
+    return _with_refine_params(faiss_index, base_index, params)
+
+def _faiss_index_of(index: VectorStoreIndex) -> Optional[faiss.Index]:
+    return getattr(getattr(index, 'vector_store', None), '_faiss_index', None)
+
+def _nodes_for_hits(index: VectorStoreIndex, ids: np.ndarray,
+                    scores: np.ndarray) -> List[NodeWithScore]:
+    '''
+    Maps FAISS ids to the stored nodes, the same way the index retriever does
+    '''
+    nodes_dict = index.index_struct.nodes_dict
+    hits = [(nodes_dict[str(i)], float(score)) for i, score in zip(ids, scores) if i != -1]
+    nodes = index.docstore.get_nodes([node_id for node_id, _ in hits])
+    return [NodeWithScore(node=node, score=score) for node, (_, score) in zip(nodes, hits)]
+
+def _reranked_search(query_embedding: List[float], index: VectorStoreIndex,
+                     top_k: int) -> Optional[List[NodeWithScore]]:
+    '''
+    Fetches RERANK_CANDIDATE_FACTOR * top_k candidates and keeps the top_k by cosine
+    similarity with their stored vectors: the float32 vectors of flat and refine-flat
+    indexes, the vectors decoded from the 8-bit codes of the default HNSW-SQ index.
+    Returns None when the index cannot reconstruct its vectors (e.g. IVF without a
+    direct map)
+    '''
+    faiss_index = _faiss_index_of(index)
+    if faiss_index is None:
+        return None
+
+    query = np.asarray([query_embedding], dtype='float32')
+    n_candidates = top_k * RERANK_CANDIDATE_FACTOR
+    _, ids = faiss_index.search(query, n_candidates,
+                                params=_search_params(faiss_index, n_candidates))
+    ids = ids[0][ids[0] != -1]
+    try:
+        vectors = faiss_index.reconstruct_batch(ids)
+    except RuntimeError as e:
+        logging.warning('Cannot re-rank, vectors are not reconstructible: %s', e)
+        return None
+
+    order, scores = rerank_by_cosine(query[0], vectors, top_k)
+    return _nodes_for_hits(index, ids[order], scores)
+
+def batch_search(query_vecs: np.ndarray, index: VectorStoreIndex,
+                 top_k: int = SIMILARITY_TOP_K) -> List[List[NodeWithScore]]:
+    '''
+    Searches many query embeddings with one FAISS call on the (n_queries, dim) matrix,
+    bypassing the retriever. Returns the nodes of each query in query order
+    '''
+    faiss_index = _faiss_index_of(index)
+    if faiss_index is None:
+        logging.error('Provided index has no FAISS vector store')
+        return [[] for _ in range(len(query_vecs))]
+
+    try:
+        queries = np.ascontiguousarray(query_vecs, dtype='float32')
+        scores, ids = faiss_index.search(queries, top_k,
+                                         params=_search_params(faiss_index, top_k))
+        return [_nodes_for_hits(index, row_ids, row_scores)
+                for row_ids, row_scores in zip(ids, scores)]
+    except Exception as e:
+        logging.error('An error occurred during batch search: %s', e, exc_info=True)
+        return [[] for _ in range(len(query_vecs))]
+
+def speculative_search_in_index(query_embedding: List[float], index: VectorStoreIndex,
+                                top_k: int = SIMILARITY_TOP_K) -> List[NodeWithScore]:
+    '''
+    Cheap approximate search straight on the FAISS index, used to start the LLM
+    before the full search has finished. Usually returns the same nodes as
+    search_in_index, but callers have to check
+    '''
+    faiss_index = _faiss_index_of(index)
+    if faiss_index is None or query_embedding is None:
+        return []
+
+    try:
+        return _search_faiss(query_embedding, index, top_k,
+                             _speculative_search_params(faiss_index))
+    except Exception as e:
+        logging.error('Speculative search failed: %s', e, exc_info=True)
+        return []
@@ -0,0 +1,77 @@
+'''Tests for the pipelined answer, which overlaps the search with a speculative
+LLM request.'''
+import asyncio
+import sys
+from pathlib import Path
+from llama_index.core.schema import NodeWithScore, TextNode
+import rag.ask_llm
+from rag.ask_llm import CarAssistant
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+class StubLLM:
+    '''Answers with the queued results in order: a string is returned, an exception
+    raised and None waits until the request is cancelled.'''
+    def __init__(self, *results):
+        self.results = list(results)
+        self.prompts = []
+        self.cancelled = 0
+
+    async def agenerate_answer(self, prompt, system_prompt=None):  # pylint: disable=unused-argument
+        '''Records the prompt and returns the next queued result.'''
+        self.prompts.append(prompt)
+        result = self.results.pop(0)
+        if result is None:
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+def make_nodes(*texts):
+    '''Returns scored nodes with the given texts.'''
+    return [NodeWithScore(node=TextNode(text=text, id_=text), score=1.0) for text in texts]
+
+def answer(monkeypatch, llm, speculative_nodes, final_nodes):
+    '''Runs the pipelined answer with stub search functions.'''
+    monkeypatch.setattr(rag.ask_llm, 'speculative_search_in_index',
+                        lambda *args: speculative_nodes)
+    monkeypatch.setattr(rag.ask_llm, 'search_in_index', lambda *args: final_nodes)
+    assistant = CarAssistant(query='How often to change the oil?', nodes=None, llm=llm)
+    return asyncio.run(assistant.aget_answer_pipelined(None, 'oil change', [0.0]))
+
+def test_confirmed_speculative_answer_is_kept(monkeypatch):
+    '''Checks that the speculative answer is used when the final nodes match.'''
+    llm = StubLLM('speculative')
+    nodes = make_nodes('oil every 10,000 km', 'oil grade 5W-30')
+
+    result = answer(monkeypatch, llm, nodes, make_nodes('oil every 10,000 km', 'oil grade 5W-30'))
+
+    assert result == ('speculative', 'oil every 10,000 km\n\n---\n\noil grade 5W-30')
+    assert len(llm.prompts) == 1
+
+def test_rejected_speculative_answer_is_cancelled(monkeypatch):
+    '''Checks that a speculative request on other nodes is cancelled and the answer
+    is generated from the final nodes.'''
+    llm = StubLLM(None, 'final')
+
+    result = answer(monkeypatch, llm, make_nodes('tyre pressure'), make_nodes('oil grade 5W-30'))
+
+    assert result == ('final', 'oil grade 5W-30')
+    assert llm.cancelled == 1
+    assert 'oil grade 5W-30' in llm.prompts[1]
+
+def test_failed_confirmed_speculative_answer_is_retried(monkeypatch):
+    '''Checks that a failed speculative request on the right nodes is retried
+    instead of returning an error.'''
+    llm = StubLLM(TimeoutError('proxy timeout'), 'retried')
+    nodes = make_nodes('oil grade 5W-30')
+
+    result = answer(monkeypatch, llm, nodes, make_nodes('oil grade 5W-30'))
+
+    assert result == ('retried', 'oil grade 5W-30')
+    assert len(llm.prompts) == 2
@@ -0,0 +1,41 @@
+'''Tests for the text context extracted around the images of a markdown file.'''
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+# describe imports its sibling hub_config module by bare name
+sys.path.insert(0, str(project_root / 'data_processing'))
+
+from describe import MarkdownImageProcessor  # pylint: disable=wrong-import-position
+
+PLACEHOLDER = '<!-- picture -->'
+
+def context_around(text: str, tag: str, context_words: int = 3) -> str:
+    '''Returns the context of the first occurrence of tag, without building an llm client.'''
+    processor = MarkdownImageProcessor.__new__(MarkdownImageProcessor)
+    processor.context_words = context_words
+    words, word_starts = processor._split_words(text)  # pylint: disable=protected-access
+    start = text.index(tag)
+    return processor._extract_and_clean_context(  # pylint: disable=protected-access
+        words, word_starts, start, start + len(tag)
+    )
+
+def test_text_glued_to_closing_tag_is_kept():
+    '''Checks that text directly after a closing tag is part of the after-context.'''
+    text = f'Engine bay overview <figure>{PLACEHOLDER}</figure>Next to the battery'
+
+    assert context_around(text, PLACEHOLDER) == \
+        'bay overview <figure> </figure> Next to'
+
+def test_text_glued_to_image_tag_is_kept():
+    '''Checks that text glued to either side of an image tag stays in the context.'''
+    text = 'Check the dipstick![oil](images/oil.png)level weekly'
+
+    assert context_around(text, '![oil](images/oil.png)') == 'Check the dipstick level weekly'
+
+def test_other_image_tags_are_removed():
+    '''Checks that other image tags in the window are dropped from the context.'''
+    text = 'Front ![a](a.png) wheel ![b](b.png) rear wheel'
+
+    assert context_around(text, '![b](b.png)') == 'Front wheel rear wheel'
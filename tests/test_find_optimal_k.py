@@ -0,0 +1,51 @@
+'''Tests for the batched score-drop kernels used by the optimal top_k analysis.'''
+import sys
+from pathlib import Path
+import numpy as np
+import pytest
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+# find_optimal_k imports its sibling search module by bare name
+sys.path.insert(0, str(project_root / 'rag'))
+
+import find_optimal_k  # pylint: disable=wrong-import-position
+
+WIDTH = 50
+
+def ragged_scores():
+    '''Returns descending score rows of 0 to WIDTH entries, ties included.'''
+    rng = np.random.default_rng(0)
+    rows = [[], [0.9], [0.9, 0.9], [0.9, 0.8, 0.7], [0.9, 0.5, 0.4, 0.0]]
+    for length in rng.integers(0, WIDTH + 1, size=200):
+        rows.append(sorted(np.round(rng.random(length), 2).tolist(), reverse=True))
+    return rows
+
+def padded(rows):
+    '''Packs rows into a -inf padded matrix and their lengths, as main does.'''
+    lengths = np.array([len(row) for row in rows], dtype=np.int64)
+    matrix = np.full((len(rows), WIDTH), -np.inf)
+    for i, row in enumerate(rows):
+        matrix[i, :len(row)] = row
+    return matrix, lengths
+
+def expected_drops(rows):
+    '''Drop index of every row from the single-row function, -1 when undefined.'''
+    expected = []
+    for row in rows:
+        drop_index = find_optimal_k.find_largest_score_drop_index(row) if len(row) >= 2 else None
+        expected.append(-1 if drop_index is None else drop_index)
+    return expected
+
+@pytest.mark.parametrize('kernel', [
+    find_optimal_k._drop_indices_numpy,
+    find_optimal_k._drop_indices_loop,
+    find_optimal_k.drop_indices,
+])
+def test_drop_kernels_match_single_row_function(kernel):
+    '''Checks every kernel against find_largest_score_drop_index on ragged rows,
+    including rows with 0 or 1 score.'''
+    rows = ragged_scores()
+    matrix, lengths = padded(rows)
+
+    assert kernel(matrix, lengths).tolist() == expected_drops(rows)
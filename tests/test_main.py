@@ -0,0 +1,65 @@
+'''Tests for the on-disk chunk formats of the data processing pipeline.'''
+import sys
+from pathlib import Path
+import pytest
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+# main imports its sibling pipeline modules by bare name
+sys.path.insert(0, str(project_root / 'data_processing'))
+
+import main as pipeline  # pylint: disable=wrong-import-position
+
+@pytest.fixture
+def nodes():
+    '''Provides linked chunks with metadata, like the ones TextChunker produces.'''
+    chunks = [
+        TextNode(
+            id_=f'chunk-{i}',
+            text=f'Car model: Honda\n\nChunk {i} is about the engine oil, ünïcode included.',
+            metadata={'file_name': 'honda.md', 'header_path': '/Engine/Oil/',
+                      'car_model': 'Honda', 'page': i}
+        )
+        for i in range(3)
+    ]
+    for prev_node, next_node in zip(chunks, chunks[1:]):
+        prev_node.relationships[NodeRelationship.NEXT] = next_node.as_related_node_info()
+        next_node.relationships[NodeRelationship.PREVIOUS] = prev_node.as_related_node_info()
+    chunks[0].relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(
+        node_id='honda.md', metadata={'file_name': 'honda.md'}
+    )
+    return chunks
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_parquet_round_trip(tmp_path: Path, monkeypatch, nodes, use_orjson: bool):
+    '''Checks that chunks read back from Parquet equal the written ones, with orjson
+    and with the json fallback of _dumps and _loads.'''
+    if pipeline.pa is None:
+        pytest.skip('pyarrow is not installed')
+    if use_orjson and pipeline.orjson is None:
+        pytest.skip('orjson is not installed')
+    if not use_orjson:
+        monkeypatch.setattr(pipeline, 'orjson', None)
+    path = tmp_path / 'chunks.parquet'
+
+    pipeline.save_chunks_parquet(nodes, path)
+    loaded = pipeline.load_chunks_parquet(path)
+
+    assert loaded == nodes
+    assert loaded[1].prev_node.node_id == 'chunk-0'
+    assert loaded[1].next_node.node_id == 'chunk-2'
+    assert loaded[0].source_node.metadata == {'file_name': 'honda.md'}
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_json_round_trip(tmp_path: Path, monkeypatch, nodes, use_orjson: bool):
+    '''Checks that chunks read back from JSON equal the written ones.'''
+    if use_orjson and pipeline.orjson is None:
+        pytest.skip('orjson is not installed')
+    if not use_orjson:
+        monkeypatch.setattr(pipeline, 'orjson', None)
+    path = tmp_path / 'chunks.json'
+
+    pipeline.save_chunks_json(nodes, path)
+
+    assert pipeline.load_chunks_json(path) == nodes
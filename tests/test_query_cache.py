@@ -0,0 +1,59 @@
+'''Tests for the ProximityCache used to reuse answers of near-duplicate queries.'''
+import sys
+from pathlib import Path
+import numpy as np
+from rag.query_cache import ProximityCache
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+DIM = 768
+
+def random_unit(rng: np.random.Generator) -> np.ndarray:
+    '''Returns a random unit vector.'''
+    vector = rng.standard_normal(DIM)
+    return vector / np.linalg.norm(vector)
+
+def test_near_duplicate_query_hits():
+    '''Checks that a slightly perturbed query embedding returns the cached answer.'''
+    rng = np.random.default_rng(1)
+    cache = ProximityCache(DIM, threshold=0.95)
+    query = random_unit(rng)
+    cache.put(query, ('answer', 'chunks'))
+
+    assert cache.get(query) == ('answer', 'chunks')
+    assert cache.get(query + 0.005 * rng.standard_normal(DIM)) == ('answer', 'chunks')
+
+def test_unrelated_query_misses():
+    '''Checks that an unrelated query embedding is not served from the cache.'''
+    rng = np.random.default_rng(2)
+    cache = ProximityCache(DIM, threshold=0.95)
+    cache.put(random_unit(rng), ('answer', 'chunks'))
+
+    assert cache.get(random_unit(rng)) is None
+
+def test_capacity_evicts_least_recently_used():
+    '''Checks that the least recently used entry is evicted once capacity is exceeded.'''
+    rng = np.random.default_rng(3)
+    cache = ProximityCache(DIM, capacity=2)
+    first, second, third = (random_unit(rng) for _ in range(3))
+    cache.put(first, 'first')
+    cache.put(second, 'second')
+    assert cache.get(first) == 'first'
+
+    cache.put(third, 'third')
+    assert len(cache) == 2
+    assert cache.get(second) is None
+    assert cache.get(first) == 'first'
+    assert cache.get(third) == 'third'
+
+def test_queries_for_different_models_do_not_collide():
+    '''Checks that near-identical queries keyed by different car models miss each other.'''
+    rng = np.random.default_rng(4)
+    cache = ProximityCache(DIM, threshold=0.95)
+    query = random_unit(rng)
+    cache.put(query, 'ford answer', key='Ford')
+
+    assert cache.get(query + 0.005 * rng.standard_normal(DIM), key='Honda') is None
+    assert cache.get(query, key=None) is None
+    assert cache.get(query, key='Ford') == 'ford answer'
@@ -0,0 +1,34 @@
+'''Tests for the cosine re-scoring of retrieved candidates.'''
+import sys
+from pathlib import Path
+import numpy as np
+from rag.rerank import cosine_similarities, rerank
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+DIM = 768
+
+def test_cosine_similarities_match_numpy():
+    '''Checks the similarities against a plain NumPy cosine.'''
+    rng = np.random.default_rng(0)
+    query = rng.standard_normal(DIM)
+    vectors = rng.standard_normal((20, DIM))
+
+    expected = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query))
+    assert np.allclose(cosine_similarities(query, vectors), expected, atol=1e-4)
+
+def test_rerank_returns_best_first():
+    '''Checks that rerank returns the k most similar rows in descending order.'''
+    rng = np.random.default_rng(1)
+    query = rng.standard_normal(DIM)
+    vectors = rng.standard_normal((50, DIM))
+    vectors[7] = query * 2
+    vectors[3] = query + 0.1 * rng.standard_normal(DIM)
+
+    order, scores = rerank(query, vectors, k=5)
+
+    assert list(order[:2]) == [7, 3]
+    assert len(order) == 5
+    assert np.all(np.diff(scores) <= 0)
+    assert list(order) == list(np.argsort(-cosine_similarities(query, vectors))[:5])
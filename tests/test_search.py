@@ -2,14 +2,43 @@
 and search functionality.'''
 import sys
 from pathlib import Path
-#import pytest
+import faiss
+import numpy as np
+import pytest
+from llama_index.core import StorageContext, VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import TextNode
+from llama_index.vector_stores.faiss import FaissVectorStore
 
-from rag.search import initialize_embed_model, load_vector_index, search_in_index
+from rag.search import (initialize_embed_model, load_vector_index, search_in_index,
+                        _reranked_search)
 
 
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
+DIM = 64
+
+@pytest.fixture
+def sq_index():
+    '''Provides a small HNSW index over 8-bit scalar-quantized vectors, the default
+    index type, together with the original unit vectors.'''
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, DIM)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    faiss_index = faiss.IndexHNSWSQ(DIM, faiss.ScalarQuantizer.QT_8bit, 16,
+                                    faiss.METRIC_INNER_PRODUCT)
+    faiss_index.train(vectors)  # pylint: disable=no-value-for-parameter
+    nodes = [TextNode(text=f'chunk {i}', embedding=vector.tolist())
+             for i, vector in enumerate(vectors)]
+    storage_context = StorageContext.from_defaults(
+        vector_store=FaissVectorStore(faiss_index=faiss_index)
+    )
+    index = VectorStoreIndex(nodes, storage_context=storage_context,
+                             embed_model=MockEmbedding(embed_dim=DIM))
+    return index, vectors
+
 def test_embed_model_initializes():
     '''Tests that the embedding model initializes correctly.'''
     model = initialize_embed_model('BAAI/bge-base-en-v1.5', None, {})
@@ -27,3 +56,21 @@ def test_search_returns_results():
     index = load_vector_index(embed_model)
     results = search_in_index('why there is a problem with the engine of my honda?', index)
     assert isinstance(results, list)
+
+def test_reranked_search_on_quantized_index(sq_index):
+    '''Checks that the re-rank runs on the SQ index and orders the nodes by cosine
+    similarity with their decoded vectors.'''
+    index, vectors = sq_index
+    rng = np.random.default_rng(1)
+    query = vectors[17] + 0.05 * rng.standard_normal(DIM).astype('float32')
+
+    results = _reranked_search(query.tolist(), index, 5)
+
+    assert results is not None
+    assert len(results) == 5
+    assert results[0].node.get_content() == 'chunk 17'
+    scores = [result.score for result in results]
+    assert scores == sorted(scores, reverse=True)
+    ids = [int(result.node.get_content().split()[1]) for result in results]
+    expected = vectors[ids] @ query / np.linalg.norm(query)
+    assert np.allclose(scores, expected, atol=0.02)
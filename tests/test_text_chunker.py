@@ -0,0 +1,115 @@
+'''Tests for the single-pass Markdown section splitter and size-bounded text splitter.'''
+import sys
+from pathlib import Path
+import pytest
+from llama_index.core.schema import NodeRelationship
+from data_processing.text_chunker import TextChunker, mentioned_model
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+MAX_CHUNK_SIZE = 120
+CHUNK_OVERLAP = 30
+
+@pytest.fixture
+def chunker() -> TextChunker:
+    '''Provides a chunker with small size bounds so short texts get split.'''
+    return TextChunker(max_chunk_size_chars=MAX_CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+@pytest.fixture
+def long_text() -> str:
+    '''Provides prose several times longer than the maximum chunk size.'''
+    sentences = [f'Sentence number {i} is about the engine and the brakes.' for i in range(40)]
+    return ' '.join(sentences)
+
+def test_split_text_respects_max_chunk_size(chunker: TextChunker, long_text: str):
+    '''Checks that every chunk fits the size bound and no text is lost.'''
+    chunks = chunker._split_text(long_text)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= MAX_CHUNK_SIZE for chunk in chunks)
+    for i in range(40):
+        assert any(f'Sentence number {i} ' in chunk for chunk in chunks)
+
+def test_split_text_overlaps_consecutive_chunks(chunker: TextChunker, long_text: str):
+    '''Checks that each chunk starts with text repeated from the end of the previous one.'''
+    chunks = chunker._split_text(long_text)
+
+    for previous, current in zip(chunks, chunks[1:]):
+        head = current.split(' ')[0]
+        assert head in previous[-(CHUNK_OVERLAP + len(head) + 1):]
+
+def test_split_text_keeps_short_text_whole(chunker: TextChunker):
+    '''Checks that text within the bound is returned as a single stripped chunk.'''
+    assert chunker._split_text('  Short text.  ') == ['Short text.']
+
+def test_split_sections_ignores_headings_in_code_fences(chunker: TextChunker):
+    '''Checks that heading-like lines inside fenced code do not start a section.'''
+    content = (
+        '# Setup\n'
+        'Run this:\n'
+        '```bash\n'
+        '# not a heading\n'
+        'make install\n'
+        '```\n'
+        '# Usage\n'
+        'Start the app.\n'
+    )
+    sections = chunker._split_sections(content, 'manual.md')
+
+    assert [text.splitlines()[0] for text, _ in sections] == ['# Setup', '# Usage']
+    assert '# not a heading' in sections[0][0]
+    assert all(meta['file_name'] == 'manual.md' for _, meta in sections)
+
+def test_split_sections_nests_header_path(chunker: TextChunker):
+    '''Checks that header_path lists the parent headings of each section.'''
+    content = (
+        'Intro text.\n'
+        '# Engine\n'
+        'Engine text.\n'
+        '## Oil\n'
+        'Oil text.\n'
+        '### Capacity\n'
+        'Capacity text.\n'
+        '## Filter\n'
+        'Filter text.\n'
+        '# Brakes\n'
+        'Brake text.\n'
+    )
+    sections = chunker._split_sections(content, 'manual.md')
+
+    assert [(text.splitlines()[0], meta['header_path']) for text, meta in sections] == [
+        ('Intro text.', '/'),
+        ('# Engine', '/'),
+        ('## Oil', '/Engine/'),
+        ('### Capacity', '/Engine/Oil/'),
+        ('## Filter', '/Engine/'),
+        ('# Brakes', '/'),
+    ]
+
+def test_mentioned_model_tells_queries_apart():
+    '''Checks that queries differing only in the car model get different cache keys.'''
+    assert mentioned_model('What is the oil capacity of the Subaru?') == 'Subaru'
+    assert mentioned_model('What is the oil capacity of the Honda?') == 'Honda'
+    assert mentioned_model('oil capacity of the ford mustang') == 'Ford Mustang'
+    assert mentioned_model('What is the oil capacity?') is None
+
+@pytest.mark.parametrize('include_prev_next_rel', [True, False])
+def test_chunks_link_to_their_neighbours(tmp_path: Path, long_text: str,
+                                         include_prev_next_rel: bool):
+    '''Checks that consecutive chunks of a file are linked only when requested.'''
+    md_path = tmp_path / 'manual.md'
+    md_path.write_text(long_text, encoding='utf-8')
+    chunker = TextChunker(include_prev_next_rel=include_prev_next_rel,
+                          max_chunk_size_chars=MAX_CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+    nodes = chunker.chunk_markdown_file(md_path)
+
+    assert len(nodes) > 2
+    for prev_node, next_node in zip(nodes, nodes[1:]):
+        if include_prev_next_rel:
+            assert prev_node.next_node.node_id == next_node.node_id
+            assert next_node.prev_node.node_id == prev_node.node_id
+        else:
+            assert NodeRelationship.NEXT not in prev_node.relationships
+    assert (nodes[0].prev_node is None) and (nodes[-1].next_node is None)